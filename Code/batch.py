@@ -0,0 +1,465 @@
+"""
+Batch module - Alex Borger
+
+Runs many independent Monte Carlo replicas of the same block layout at once.
+
+Instead of one Circuit with Train/Block objects per replica, the state of every replica lives in NumPy arrays with one
+row per replica (and one column per train or block).  Each second, the countdown-only branches of the block state
+machine are applied to every train of every replica with a handful of array operations.  The branches that touch
+shared block state (occupying the next block, merger clearance, leaving a block) are then applied train by train, in
+the same order as Circuit.step(), to the subset of replicas where they happen.
+
+With numba installed (backend='numba', the default), run() instead packs every replica into the arrays of kernel.py,
+with a leading replica axis, and runs them through kernel.run_replicas: the same compiled run_kernel as
+Circuit(..., optional_params={'backend': 'numba'}), one replica per prange iteration.  backend='python' keeps the
+array operations above, for when numba isn't available.  Both backends keep the state in the same attributes between
+runs.
+
+Replicas are independent, so instead of raising, a replica that hits gridlock or 101 status is frozen and flagged in
+self.error (see ERROR_NAMES) with the time in self.error_time.  The other replicas keep running.  With
+on_fault='downtime' (see downtime.py) the replica is stopped for restart_seconds instead, then restarted with its
+trains back in their starting blocks, and breakdown_mtbf adds random breakdowns.  downtime() has the downtime of
+each replica.
+
+With sluggishness off, every replica matches a Circuit run of the same layout on either backend.  With sluggishness
+on, the dispatch delays come from self.rng using the delay distribution and antithetic settings from
+random_streams.py.  The python backend draws them in bulk for all replicas arriving at a station in the same second,
+the numba backend gives each replica its own buffer of draws, so the two backends draw the same distribution but not
+the same delays.  Breakdown gaps differ between the backends the same way.  Only the shared delay stream is supported.
+
+As a rough guide, 10,000 replicas of the dual station layout in sim_tests.py (4 trains, sluggishness on) advance one
+simulated hour in about 1.2 seconds on the numba backend on one core, plus about 2 seconds to compile the first time
+(cached after that), and ten hours in about 12 seconds.  prange spreads the replicas over every core numba is allowed
+to use.  The python backend takes about 6-8 seconds for one hour, and looping Circuit over the seeds about 10 seconds
+on the numba backend or 100 on the python one.
+"""
+
+import numpy as np
+
+from downtime import STOP_GRIDLOCK, STOP_101, STOP_BREAKDOWN, STOP_KINDS, breakdown_rng, downtime_settings, \
+    draw_breakdown_gaps
+import kernel
+from kernel import KERNEL_OK, KERNEL_GRIDLOCK, KERNEL_HALTED, KERNEL_NEED_DELAYS, KERNEL_NEED_GAPS, NUM_REPLICA_FIELDS, \
+    NUM_SETTINGS, NUM_STATE_FIELDS, NUM_TRAIN_FIELDS
+from random_streams import delay_settings, draw_delays
+from layout import Layout, STATUS_HELD, STATUS_BEFORE_BLOCK, STATUS_AFTER_BLOCK_FROM_HELD, STATUS_AFTER_BLOCK_NOT_HELD
+
+ERROR_NONE = 0
+ERROR_GRIDLOCK = 1
+ERROR_101 = 2
+ERROR_NAMES = ['ok', 'gridlock', '101 status']
+ERROR_STOPS = {ERROR_GRIDLOCK: STOP_GRIDLOCK, ERROR_101: STOP_101}
+# kernel return code of each ERROR_*, and back
+KERNEL_CODES = np.array([KERNEL_OK, KERNEL_GRIDLOCK, KERNEL_HALTED])
+KERNEL_ERRORS = {KERNEL_GRIDLOCK: ERROR_GRIDLOCK, KERNEL_HALTED: ERROR_101}
+# the kernel train column each status counts down in, see BatchCircuit.countdown
+COUNTDOWN_FIELDS = np.array([kernel.T_HOLD_LEFT, kernel.T_REACH, kernel.T_CLEAR_FROM_HELD, kernel.T_CLEAR_IN_MOTION])
+# per replica draws for the numba backend, topped up whenever a replica runs out
+REPLICA_DELAYS = 256
+REPLICA_GAPS = 16
+
+
+class BatchCircuit:
+    def __init__(self, block_ref_dict, num_trains, num_replicas, optional_params=None):
+        self.layout = Layout(block_ref_dict)
+        self.num_trains = num_trains
+        self.num_replicas = num_replicas
+        self.time = 0
+        self.dispatch_sluggishness = False
+        self.sluggishness_mu = None
+        self.sluggishness_sigma = None
+        self.random_seed = 0
+        self.circuit_completion_blocks = None
+        self.backend = 'numba'
+        if optional_params:
+            if 'backend' in optional_params:
+                self.backend = optional_params['backend']
+                if self.backend not in ['python', 'numba']:
+                    raise ValueError(f"{self.backend} not a valid backend.  Must be in ['python', 'numba'].")
+            if 'sluggishness' in optional_params:
+                self.dispatch_sluggishness = optional_params['sluggishness']
+                self.sluggishness_mu = optional_params['sluggishness_mu']
+                self.sluggishness_sigma = optional_params['sluggishness_sigma']
+            if 'random_seed' in optional_params:
+                self.random_seed = optional_params['random_seed']
+            if 'circuit_completion_blocks' in optional_params:
+                self.circuit_completion_blocks = optional_params['circuit_completion_blocks']
+        self.delay_distribution, self.delay_params, delay_stream_mode, self.antithetic = delay_settings(optional_params)
+        if delay_stream_mode != 'shared':
+            raise ValueError("BatchCircuit only supports shared delay streams.")
+        if self.backend == 'numba' and not kernel.HAVE_NUMBA:
+            self.backend = 'python'
+        self.rng = np.random.default_rng(self.random_seed)
+        self.completion_mask = self.layout.block_mask(self.circuit_completion_blocks)
+
+        # (replica, train) arrays are stored column-major so each train's column is contiguous
+        shape = (num_replicas, num_trains)
+        start_blocks = np.array(self.layout.initial_train_blocks(num_trains), dtype=np.int64)
+        self.start_blocks = start_blocks
+        self.current_block = np.asfortranarray(np.tile(start_blocks, (num_replicas, 1)))
+        self.status = np.full(shape, STATUS_HELD, dtype=np.int8, order='F')
+        # only one of seconds_to_reach_block, seconds_to_clear_from_held, seconds_to_clear_block_in_motion and
+        # mandatory_hold_left counts down at a time, and the status says which one, so they share a column
+        self.countdown = np.zeros(shape, dtype=np.int32, order='F')
+        self.seconds_to_clear_merger = np.zeros(shape, dtype=np.int32, order='F')
+        self.seconds_held_at_current_block = np.zeros(shape, dtype=np.int64, order='F')
+        self.total_seconds_held = np.zeros(shape, dtype=np.int64, order='F')
+        self.circuits_completed = np.zeros(shape, dtype=np.int64, order='F')
+
+        block_shape = (num_replicas, self.layout.num_blocks)
+        self.is_occupied = np.tile(self.layout.is_occupied, (num_replicas, 1))
+        self.is_occupied[:, start_blocks] = True
+        # splitter switch position is the splitter block's next block, so it is tracked per replica here
+        self.next_block = np.tile(self.layout.next_block, (num_replicas, 1))
+        self.merger_switch_position = np.tile(self.layout.merger_block_a, (num_replicas, 1))
+        self.block_seconds_held = np.zeros(block_shape, dtype=np.int64)
+
+        self.alive = np.ones(num_replicas, dtype=bool)
+        self.error = np.full(num_replicas, ERROR_NONE, dtype=np.int64)
+        self.error_time = np.full(num_replicas, -1, dtype=np.int64)
+
+        # stopped replicas are not alive, and restart at down_until
+        self.on_fault, self.restart_seconds, self.breakdown_mtbf, self.breakdown_seconds = \
+            downtime_settings(optional_params)
+        self.models_downtime = self.on_fault == 'downtime' or self.breakdown_mtbf is not None
+        self.down_until = np.full(num_replicas, -1, dtype=np.int64)
+        self.downtime_seconds = np.zeros(num_replicas, dtype=np.int64)
+        self.stop_counts = np.zeros((num_replicas, len(STOP_KINDS)), dtype=np.int64)
+        self.breakdown_rng = breakdown_rng(self.random_seed)
+        self.next_breakdown = np.full(num_replicas, -1, dtype=np.int64)
+        if self.breakdown_mtbf is not None:
+            self.next_breakdown = draw_breakdown_gaps(self.breakdown_rng, self.breakdown_mtbf, num_replicas)
+        # numba backend only: each replica's dispatch delays and breakdown gaps, see init_buffers
+        self.delays = None
+        self.delay_pos = None
+        self.gaps = None
+        self.gap_pos = None
+
+    def step(self):
+        if self.backend == 'numba':
+            self.run(1)
+        else:
+            self.step_arrays()
+
+    def run(self, seconds):
+        if self.backend == 'numba':
+            self.run_kernel(seconds)
+        else:
+            for _ in range(seconds):
+                self.step_arrays()
+
+    def step_arrays(self):
+        """ one second for every replica, on the python backend """
+        if self.models_downtime:
+            self.restart(np.flatnonzero(self.down_until == self.time))
+            if self.breakdown_mtbf is not None:
+                self.stop(np.flatnonzero(self.alive & (self.next_breakdown == self.time)), STOP_BREAKDOWN,
+                          self.breakdown_seconds)
+        # countdown-only seconds, all trains of all replicas at once
+        alive = self.alive[:, None]
+        counting = alive & (self.countdown > 0)
+        event = alive & ~counting
+        self.countdown -= counting
+        merging = counting & (self.seconds_to_clear_merger > 0)
+        self.seconds_to_clear_merger -= merging
+        merger_cleared = merging & (self.seconds_to_clear_merger == 0)
+        if self.num_trains == 1:
+            merger_cleared[:] = False
+
+        # seconds that read or change block state, train by train in the same order as Circuit.step()
+        bounds = np.arange(self.num_trains + 1) * self.num_replicas
+        events = np.flatnonzero(event.T)
+        event_bounds = np.searchsorted(events, bounds)
+        mergers = np.flatnonzero(merger_cleared.T)
+        merger_bounds = np.searchsorted(mergers, bounds)
+        trains_blocked = np.zeros(self.num_replicas, dtype=np.int64)
+        for i in range(self.num_trains):
+            rows = mergers[merger_bounds[i]:merger_bounds[i + 1]] - bounds[i]
+            rows = rows[self.alive[rows]]
+            if len(rows):
+                self.clear_merger(rows, self.current_block[rows, i])
+            rows = events[event_bounds[i]:event_bounds[i + 1]] - bounds[i]
+            rows = rows[self.alive[rows]]
+            if not len(rows):
+                continue
+            status = self.status[rows, i]
+            held = status == STATUS_HELD
+            before_block = status == STATUS_BEFORE_BLOCK
+            if held.any():
+                self.attempt_from_held(rows[held], i, trains_blocked)
+            if before_block.any():
+                self.reach_block(rows[before_block], i, trains_blocked)
+            leaving = ~held & ~before_block
+            if leaving.any():
+                self.leave_block(rows[leaving], i)
+        gridlocked = (trains_blocked == self.num_trains) & self.alive
+        self.flag_error(np.flatnonzero(gridlocked), ERROR_GRIDLOCK)
+        if self.models_downtime:
+            self.downtime_seconds += self.down_until > self.time
+        self.time += 1
+
+    def run_kernel(self, seconds):
+        """ run() on the numba backend: pack, kernel.run_replicas until every replica reaches the end, unpack """
+        kernel.compile_kernels()
+        if self.delays is None:
+            self.init_buffers()
+        end = self.time + seconds
+        trains, held_by_block, block_state, replica_state = self.pack()
+        initial_trains, initial_block_state = self.initial_state()
+        block_params = kernel.layout_block_params(self.layout, self.completion_mask)
+        settings = np.zeros(NUM_SETTINGS, dtype=np.int64)
+        settings[kernel.SET_MERGER_ENABLED] = self.num_trains > 1
+        settings[kernel.SET_SLUGGISH] = self.dispatch_sluggishness
+        settings[kernel.SET_DOWNTIME] = self.on_fault == 'downtime'
+        settings[kernel.SET_RESTART_SECONDS] = self.restart_seconds
+        settings[kernel.SET_BREAKDOWN_SECONDS] = self.breakdown_seconds
+        settings[kernel.SET_BREAKDOWNS] = self.breakdown_mtbf is not None
+        delays, gaps = self.delays, self.gaps
+        while True:
+            kernel.run_replicas(end, trains, held_by_block, block_state, block_params, initial_trains,
+                                initial_block_state, delays, gaps, replica_state, settings)
+            codes = replica_state[:, kernel.R_CODE]
+            need_delays = np.flatnonzero(codes == KERNEL_NEED_DELAYS)
+            need_gaps = np.flatnonzero(codes == KERNEL_NEED_GAPS)
+            if not len(need_delays) and not len(need_gaps):
+                break
+            if len(need_delays):
+                self.refill_delays(delays, replica_state, need_delays)
+            if len(need_gaps):
+                gaps[need_gaps] = draw_breakdown_gaps(self.breakdown_rng, self.breakdown_mtbf,
+                                                      (len(need_gaps), REPLICA_GAPS))
+                replica_state[need_gaps, kernel.R_GAP_POS] = 0
+        self.unpack(trains, held_by_block, block_state, replica_state)
+        self.time = end
+
+    def init_buffers(self):
+        """ per replica dispatch delays, used from delay_pos on, and breakdown gaps for the next restarts, used from
+        gap_pos on.  kept between runs, topped up whenever a replica runs out
+        """
+        self.delays = np.zeros((self.num_replicas, max(REPLICA_DELAYS, 2 * self.num_trains)), dtype=np.int64)
+        if self.dispatch_sluggishness:
+            self.delays[:] = draw_delays(self.rng, self.delay_distribution, self.delay_params, self.delays.shape,
+                                         self.antithetic)
+        self.delay_pos = np.zeros(self.num_replicas, dtype=np.int64)
+        # empty, the first restart draws them
+        self.gaps = np.zeros((self.num_replicas, REPLICA_GAPS), dtype=np.int64)
+        self.gap_pos = np.full(self.num_replicas, REPLICA_GAPS, dtype=np.int64)
+
+    def refill_delays(self, delays, replica_state, rows):
+        """ fresh draws for replicas rows, after the ones they haven't used yet, same as Circuit.refill_delays """
+        width = delays.shape[1]
+        fresh = draw_delays(self.rng, self.delay_distribution, self.delay_params, (len(rows), width), self.antithetic)
+        source = np.arange(width) + replica_state[rows, kernel.R_DELAY_POS][:, None]
+        unused = np.take_along_axis(delays[rows], np.minimum(source, width - 1), axis=1)
+        delays[rows] = np.where(source < width, unused, fresh)
+        replica_state[rows, kernel.R_DELAY_POS] = 0
+
+    def initial_state(self):
+        """ kernel (trains, block_state) arrays of one replica at t=0, what restarts go back to """
+        trains = np.zeros((self.num_trains, NUM_TRAIN_FIELDS), dtype=np.int64)
+        trains[:, kernel.T_BLOCK] = self.start_blocks
+        trains[:, kernel.T_NEXT_BLOCK] = self.layout.next_block[self.start_blocks]
+        trains[:, kernel.T_STATUS] = STATUS_HELD
+        block_state = np.zeros((self.layout.num_blocks, NUM_STATE_FIELDS), dtype=np.int64)
+        block_state[:, kernel.S_OCCUPIED] = self.layout.is_occupied
+        block_state[self.start_blocks, kernel.S_OCCUPIED] = 1
+        block_state[:, kernel.S_MERGER_POSITION] = self.layout.merger_block_a
+        block_state[:, kernel.S_NEXT] = self.layout.next_block
+        return trains, block_state
+
+    def pack(self):
+        """ (trains, held_by_block, block_state, replica_state) kernel arrays with a leading replica axis """
+        rows = np.arange(self.num_replicas)[:, None]
+        trains = np.zeros((self.num_replicas, self.num_trains, NUM_TRAIN_FIELDS), dtype=np.int64)
+        trains[..., kernel.T_BLOCK] = self.current_block
+        trains[..., kernel.T_NEXT_BLOCK] = self.next_block[rows, self.current_block]
+        trains[..., kernel.T_STATUS] = self.status
+        np.put_along_axis(trains, COUNTDOWN_FIELDS[self.status][..., None], self.countdown[..., None], axis=2)
+        trains[..., kernel.T_CLEAR_MERGER] = self.seconds_to_clear_merger
+        trains[..., kernel.T_HELD_AT_BLOCK] = self.seconds_held_at_current_block
+        trains[..., kernel.T_TOTAL_HELD] = self.total_seconds_held
+        trains[..., kernel.T_CIRCUITS] = self.circuits_completed
+        # seconds held are added to block_seconds_held afterwards, so the per train split starts from zero
+        held_by_block = np.zeros((self.num_replicas, self.num_trains, self.layout.num_blocks), dtype=np.int64)
+        block_state = np.stack([self.is_occupied, self.merger_switch_position, self.next_block], axis=2).astype(np.int64)
+        replica_state = np.zeros((self.num_replicas, NUM_REPLICA_FIELDS), dtype=np.int64)
+        replica_state[:, kernel.R_TIME] = self.time
+        replica_state[:, kernel.R_DELAY_POS] = self.delay_pos
+        replica_state[:, kernel.R_GAP_POS] = self.gap_pos
+        replica_state[:, kernel.R_DOWN_UNTIL] = self.down_until
+        replica_state[:, kernel.R_NEXT_BREAKDOWN] = self.next_breakdown
+        replica_state[:, kernel.R_DOWNTIME] = self.downtime_seconds
+        replica_state[:, kernel.R_ERROR] = KERNEL_CODES[self.error]
+        replica_state[:, kernel.R_ERROR_TIME] = self.error_time
+        replica_state[:, kernel.R_STOPS:kernel.R_STOPS + len(STOP_KINDS)] = self.stop_counts
+        return trains, held_by_block, block_state, replica_state
+
+    def unpack(self, trains, held_by_block, block_state, replica_state):
+        """ write the kernel arrays back to the attributes the python backend uses """
+        self.current_block[:] = trains[..., kernel.T_BLOCK]
+        self.status[:] = trains[..., kernel.T_STATUS]
+        self.countdown[:] = np.take_along_axis(trains, COUNTDOWN_FIELDS[self.status][..., None], axis=2)[..., 0]
+        # only counts down before a block, the python backend drops it when the train gets there
+        self.seconds_to_clear_merger[:] = np.where(self.status == STATUS_BEFORE_BLOCK, trains[..., kernel.T_CLEAR_MERGER],
+                                                   0)
+        self.seconds_held_at_current_block[:] = trains[..., kernel.T_HELD_AT_BLOCK]
+        self.total_seconds_held[:] = trains[..., kernel.T_TOTAL_HELD]
+        self.circuits_completed[:] = trains[..., kernel.T_CIRCUITS]
+        self.block_seconds_held += held_by_block.sum(axis=1)
+        self.is_occupied[:] = block_state[..., kernel.S_OCCUPIED].astype(bool)
+        self.merger_switch_position[:] = block_state[..., kernel.S_MERGER_POSITION]
+        self.next_block[:] = block_state[..., kernel.S_NEXT]
+        self.delay_pos = replica_state[:, kernel.R_DELAY_POS].copy()
+        self.gap_pos = replica_state[:, kernel.R_GAP_POS].copy()
+        self.down_until[:] = replica_state[:, kernel.R_DOWN_UNTIL]
+        self.next_breakdown[:] = replica_state[:, kernel.R_NEXT_BREAKDOWN]
+        self.downtime_seconds[:] = replica_state[:, kernel.R_DOWNTIME]
+        self.stop_counts[:] = replica_state[:, kernel.R_STOPS:kernel.R_STOPS + len(STOP_KINDS)]
+        failed = replica_state[:, kernel.R_ERROR] != 0
+        self.error[failed] = [KERNEL_ERRORS[code] for code in replica_state[failed, kernel.R_ERROR]]
+        self.error_time[failed] = replica_state[failed, kernel.R_ERROR_TIME]
+        self.alive[:] = (self.error == ERROR_NONE) & (self.down_until < 0)
+
+    def occupy(self, rows, target, requester):
+        """ vectorized Block.occupy for one requesting block per row.  returns mask of rows that got the block """
+        free = ~self.is_occupied[rows, target]
+        has_merger = self.layout.has_merger_switch[target]
+        granted = free & (~has_merger | (self.merger_switch_position[rows, target] == requester))
+        self.is_occupied[rows[granted], target[granted]] = True
+        return granted
+
+    def clear_merger(self, rows, merger):
+        """ merger switch decision once a train clears the merger, same rules as Circuit.step_train """
+        active = self.merger_switch_position[rows, merger]
+        inactive = np.where(active == self.layout.merger_block_a[merger],
+                            self.layout.merger_block_b[merger], self.layout.merger_block_a[merger])
+        active_occupied = self.is_occupied[rows, active]
+        inactive_occupied = self.is_occupied[rows, inactive]
+        splitter = self.layout.corresponding_splitter_block[merger]
+        splitter_to_inactive = self.next_block[rows, splitter] == inactive
+        switch = (~active_occupied & inactive_occupied) | (~active_occupied & ~inactive_occupied & splitter_to_inactive)
+        self.merger_switch_position[rows[switch], merger[switch]] = inactive[switch]
+
+    def attempt_from_held(self, rows, i, trains_blocked):
+        curr = self.current_block[rows, i]
+        granted = self.occupy(rows, self.next_block[rows, curr], curr)
+        stuck, curr_stuck = rows[~granted], curr[~granted]
+        halted = ~self.layout.can_operate_from_stop[curr_stuck]
+        if halted.any():
+            self.flag_error(stuck[halted], ERROR_101)
+            stuck, curr_stuck = stuck[~halted], curr_stuck[~halted]
+        self.seconds_held_at_current_block[stuck, i] += 1
+        self.total_seconds_held[stuck, i] += 1
+        self.block_seconds_held[stuck, curr_stuck] += 1
+        trains_blocked[stuck] += 1
+        released = rows[granted]
+        self.countdown[released, i] = self.layout.seconds_to_clear_from_held[curr[granted]] - 1
+        self.status[released, i] = STATUS_AFTER_BLOCK_FROM_HELD
+
+    def reach_block(self, rows, i, trains_blocked):
+        curr = self.current_block[rows, i]
+        # a merger clearance that did not finish before the block is never checked, so drop it
+        self.seconds_to_clear_merger[rows, i] = 0
+        stopping = self.layout.mandatory_hold[curr]
+        stop_rows = rows[stopping]
+        if len(stop_rows):
+            hold_left = self.layout.hold_time[curr[stopping]]
+            if self.dispatch_sluggishness:
+                hold_left = hold_left + draw_delays(self.rng, self.delay_distribution, self.delay_params, len(stop_rows),
+                                                    self.antithetic)
+            self.status[stop_rows, i] = STATUS_HELD
+            self.countdown[stop_rows, i] = hold_left - 1
+        rows, curr = rows[~stopping], curr[~stopping]
+        if not len(rows):
+            return
+        granted = self.occupy(rows, self.next_block[rows, curr], curr)
+        stuck, curr_stuck = rows[~granted], curr[~granted]
+        self.status[stuck, i] = STATUS_HELD
+        trains_blocked[stuck] += 1
+        halted = ~self.layout.can_operate_from_stop[curr_stuck]
+        if halted.any():
+            self.flag_error(stuck[halted], ERROR_101)
+            stuck = stuck[~halted]
+        self.seconds_held_at_current_block[stuck, i] += 1
+        passing = rows[granted]
+        self.countdown[passing, i] = self.layout.seconds_to_clear_block_in_motion[curr[granted]] - 1
+        self.status[passing, i] = STATUS_AFTER_BLOCK_NOT_HELD
+
+    def leave_block(self, rows, i):
+        layout = self.layout
+        curr = self.current_block[rows, i]
+        nxt = self.next_block[rows, curr]
+        self.current_block[rows, i] = nxt
+        self.countdown[rows, i] = layout.seconds_to_reach_block[nxt] - 1
+        clear_merger = layout.seconds_to_clear_merger[nxt]
+        self.seconds_to_clear_merger[rows, i] = np.where(clear_merger > 0, clear_merger - 1, clear_merger)
+        self.seconds_held_at_current_block[rows, i] = 0
+        self.status[rows, i] = STATUS_BEFORE_BLOCK
+        self.is_occupied[rows, curr] = False
+        if self.num_trains > 1:
+            splitter = layout.has_splitter_switch[curr]
+            s_rows, s_curr = rows[splitter], curr[splitter]
+            self.next_block[s_rows, s_curr] = np.where(self.next_block[s_rows, s_curr] == layout.splitter_block_a[s_curr],
+                                                       layout.splitter_block_b[s_curr], layout.splitter_block_a[s_curr])
+        completed = self.completion_mask[nxt]
+        self.circuits_completed[rows[completed], i] += 1
+
+    def flag_error(self, rows, error):
+        if self.on_fault == 'downtime':
+            self.stop(rows, ERROR_STOPS[error], self.restart_seconds)
+            return
+        rows = rows[self.alive[rows]]
+        self.alive[rows] = False
+        self.error[rows] = error
+        self.error_time[rows] = self.time
+
+    def stop(self, rows, kind, seconds):
+        """ stop the ride in replicas rows for seconds, from this second on.  kind is one of downtime.STOP_KINDS """
+        rows = rows[self.alive[rows]]
+        self.alive[rows] = False
+        self.down_until[rows] = self.time + seconds
+        self.stop_counts[rows, kind] += 1
+
+    def restart(self, rows):
+        """ end of downtime for replicas rows: trains back in their starting blocks, switches back to their starting
+        positions.  circuits completed and seconds held are kept
+        """
+        if not len(rows):
+            return
+        layout = self.layout
+        self.current_block[rows] = self.start_blocks
+        self.status[rows] = STATUS_HELD
+        self.countdown[rows] = 0
+        self.seconds_to_clear_merger[rows] = 0
+        self.seconds_held_at_current_block[rows] = 0
+        self.is_occupied[rows] = layout.is_occupied
+        self.is_occupied[rows[:, None], self.start_blocks] = True
+        self.next_block[rows] = layout.next_block
+        self.merger_switch_position[rows] = layout.merger_block_a
+        self.down_until[rows] = -1
+        self.alive[rows] = True
+        if self.breakdown_mtbf is not None:
+            self.next_breakdown[rows] = self.time + draw_breakdown_gaps(self.breakdown_rng, self.breakdown_mtbf,
+                                                                        len(rows))
+
+    def cycles_per_hour(self):
+        """ total hourly cycles of each replica, as computed in sim_tests.py """
+        return self.circuits_completed.sum(axis=1) * 3600 / self.time
+
+    def downtime(self):
+        """ downtime of each replica, as arrays: the same entries as the 'downtime' entry of Circuit.summary() """
+        completed = self.circuits_completed.sum(axis=1)
+        running = self.time - self.downtime_seconds
+        running_rate = np.divide(completed * 3600, running, out=np.zeros(self.num_replicas), where=running > 0)
+        return {
+            'seconds': self.downtime_seconds,
+            'percent': np.round(100 * self.downtime_seconds / self.time, 2) if self.time else
+            np.zeros(self.num_replicas),
+            'stops': {kind: self.stop_counts[:, k] for k, kind in enumerate(STOP_KINDS)},
+            'cycles_per_hour_running': running_rate,
+            'cycles_lost': running_rate * self.downtime_seconds / 3600
+        }
+
+    def hold_totals(self):
+        """ dict of block name -> array of total seconds trains were held there, one entry per replica """
+        return {name: self.block_seconds_held[:, b] for b, name in enumerate(self.layout.block_names)}
@@ -0,0 +1,11 @@
+"""
+Benchmarks package - Alex Borger
+
+Speed benchmarks for the simulator, run from the Code directory:
+    python -m benchmarks --repeat 5 --warmup 1
+
+layouts.py holds the reference layouts, __main__.py runs them and appends the results to a JSON history file so a
+slowdown in Circuit.step() shows up against earlier runs.  engines.py checks that every engine and backend still gives
+the same results as the tick engine:
+    python -m benchmarks.engines --cases 200
+"""
@@ -0,0 +1,158 @@
+"""
+Benchmark runner - Alex Borger
+
+Usage (from the Code directory):
+    python -m benchmarks [--repeat N] [--warmup N] [--seconds N] [--only NAME ...] [--history PATH]
+
+For every layout in layouts.BENCHMARKS and every engine in ENGINES this measures:
+    - wall_seconds: median wall time to simulate --seconds (default 10 hours) over --repeat runs, after --warmup
+        untimed runs
+    - steps_per_second: simulated seconds per wall second, from wall_seconds
+    - peak_memory_kb: peak Python memory allocated during one run (tracemalloc)
+It also times single Block.occupy / unoccupy calls.  Results are printed, compared with the last entry of the history
+file, and appended to it.  The default history file, benchmarks/history.json, is machine specific and ignored by git.
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+import timeit
+import tracemalloc
+
+import numpy as np
+
+from benchmarks.layouts import BENCHMARKS
+from block import Block
+from circuit import Circuit
+import kernel
+
+ENGINES = {
+    'tick': {'engine': 'tick'},
+    'event': {'engine': 'event'},
+    'numba': {'backend': 'numba'}
+}
+
+DEFAULT_HISTORY = os.path.join(os.path.dirname(__file__), 'history.json')
+
+
+def build_circuit(name, engine):
+    block_ref_dict, num_trains, optional_params = BENCHMARKS[name]()
+    optional_params.update(ENGINES[engine])
+    return Circuit(block_ref_dict=block_ref_dict, num_trains=num_trains, optional_params=optional_params)
+
+
+def time_run(name, engine, seconds):
+    circuit = build_circuit(name, engine)
+    start = time.perf_counter()
+    circuit.run(seconds)
+    return time.perf_counter() - start
+
+
+def peak_memory(name, engine, seconds):
+    tracemalloc.start()
+    try:
+        circuit = build_circuit(name, engine)
+        circuit.run(seconds)
+        return tracemalloc.get_traced_memory()[1] / 1024
+    finally:
+        tracemalloc.stop()
+
+
+def bench_layout(name, engine, seconds, repeat, warmup):
+    for _ in range(warmup):
+        time_run(name, engine, seconds)
+    wall = statistics.median(time_run(name, engine, seconds) for _ in range(repeat))
+    return {
+        'wall_seconds': wall,
+        'steps_per_second': seconds / wall,
+        'peak_memory_kb': round(peak_memory(name, engine, seconds), 1)
+    }
+
+
+def bench_block_calls(repeat, number=200000):
+    """ nanoseconds per Block.occupy / unoccupy call """
+    block_ref_dict = BENCHMARKS['single_station']()[0]
+    block = Block(name='lift', block_dict=block_ref_dict['lift'])
+    occupied = Block(name='lift', block_dict=block_ref_dict['lift'])
+    occupied.occupy(override=True)
+    names = {'block': block, 'occupied': occupied}
+    loop = min(timeit.repeat('pass', number=number, repeat=repeat))
+    pair = min(timeit.repeat('block.occupy(0); block.unoccupy()', number=number, repeat=repeat, globals=names)) - loop
+    unoccupy = min(timeit.repeat('block.unoccupy()', number=number, repeat=repeat, globals=names)) - loop
+    rejected = min(timeit.repeat('occupied.occupy(0)', number=number, repeat=repeat, globals=names)) - loop
+    return {
+        'occupy_ns': round((pair - unoccupy) / number * 1e9, 1),
+        'unoccupy_ns': round(unoccupy / number * 1e9, 1),
+        'occupy_rejected_ns': round(rejected / number * 1e9, 1)
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(__file__), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_history(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return json.load(f)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description='Simulator speed benchmarks.')
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs per benchmark (median is reported)')
+    parser.add_argument('--warmup', type=int, default=1, help='untimed runs before timing')
+    parser.add_argument('--seconds', type=int, default=36000, help='simulated seconds per run')
+    parser.add_argument('--only', nargs='+', choices=list(BENCHMARKS), help='run only these layouts')
+    parser.add_argument('--engines', nargs='+', choices=list(ENGINES), default=list(ENGINES))
+    parser.add_argument('--history', default=DEFAULT_HISTORY, help='JSON history file to append results to')
+    args = parser.parse_args(argv)
+
+    engines = [engine for engine in args.engines if engine != 'numba' or kernel.HAVE_NUMBA]
+    results = {}
+    for name in args.only or BENCHMARKS:
+        for engine in engines:
+            key = f'{name}/{engine}'
+            results[key] = bench_layout(name, engine, args.seconds, args.repeat, args.warmup)
+    results['block_calls'] = bench_block_calls(args.repeat)
+
+    history = load_history(args.history)
+    previous = history[-1]['results'] if history else {}
+    print(f"{'benchmark':<28}{'wall s':>10}{'steps/s':>14}{'peak KB':>10}{'vs last':>10}")
+    for key, result in results.items():
+        if key == 'block_calls':
+            continue
+        change = ''
+        if key in previous:
+            change = f"{100 * (result['steps_per_second'] / previous[key]['steps_per_second'] - 1):+.1f}%"
+        print(f"{key:<28}{result['wall_seconds']:>10.4f}{result['steps_per_second']:>14.0f}"
+              f"{result['peak_memory_kb']:>10.1f}{change:>10}")
+    print(', '.join(f'{key}: {value}' for key, value in results['block_calls'].items()))
+
+    history.append({
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'numba': kernel.HAVE_NUMBA,
+        'machine': platform.platform(),
+        'seconds': args.seconds,
+        'repeat': args.repeat,
+        'warmup': args.warmup,
+        'results': results
+    })
+    with open(args.history, 'w') as f:
+        json.dump(history, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""
+Engine agreement check - Alex Borger
+
+Usage (from the Code directory):
+    python -m benchmarks.engines [--cases N] [--seconds N] [--seed N]
+
+The tick engine, the event engine and the numba and crosscheck backends all run the same block state machine, so for
+the same layout and seed they have to end in exactly the same state.  This runs --cases random variations of the
+reference layouts in layouts.py on the tick engine, the reference, and on each of the others, and compares:
+    - the error raised, if any (gridlock or 101 status, with its message)
+    - circuit.time and circuit.summary()
+    - the full train and block state, as packed by kernel.pack_state
+Variations randomize block durations and hold times, make some blocks e-stop only (101 status), pick train counts up
+to one per block (gridlock, including at t=0) and turn sluggishness and on_fault='downtime' on or off.  Run it after
+any change to Circuit.step_train, the event engine or the kernel.  Exits with status 1 if anything disagrees.
+"""
+
+import argparse
+import copy
+import random
+import sys
+
+import numpy as np
+
+from benchmarks.layouts import dual_station, long_circuit, single_station
+from circuit import Circuit
+import kernel
+
+LAYOUTS = [single_station, dual_station, lambda: long_circuit(num_blocks=12)]
+ENGINES = {
+    'event': {'engine': 'event'},
+    'numba': {'backend': 'numba'},
+    'crosscheck': {'backend': 'crosscheck'}
+}
+DURATION_FIELDS = ['seconds_to_reach_block', 'seconds_to_clear_from_held', 'seconds_to_clear_block_in_motion']
+
+
+def random_case(rng):
+    """ (block_ref_dict, num_trains, optional_params) for one random variation of a reference layout """
+    block_ref_dict, _, optional_params = rng.choice(LAYOUTS)()
+    for block in block_ref_dict.values():
+        for field in DURATION_FIELDS:
+            if block.get(field):
+                block[field] = rng.randint(1, 20)
+        if block.get('hold_time'):
+            block['hold_time'] = rng.randint(5, 40)
+        if block.get('seconds_to_clear_merger'):
+            block['seconds_to_clear_merger'] = rng.randint(1, 6)
+        if not block['mandatory_hold'] and rng.random() < 0.1:
+            block['can_operate_from_stop'] = False
+    num_trains = rng.randint(1, len(block_ref_dict))
+    optional_params = dict(optional_params, random_seed=rng.randrange(1000), sluggishness=rng.random() < 0.5)
+    if rng.random() < 0.25:
+        optional_params.update(on_fault='downtime', restart_seconds=rng.randint(60, 900))
+    return block_ref_dict, num_trains, optional_params
+
+
+def run_case(block_ref_dict, num_trains, optional_params, seconds):
+    """ (error message or None, time, summary, packed state) after running seconds, or up to the error """
+    try:
+        circuit = Circuit(copy.deepcopy(block_ref_dict), num_trains, optional_params)
+    except ValueError as e:
+        # layouts that can't be built fail the same way whatever the engine
+        return str(e), None, None, ()
+    error = None
+    try:
+        circuit.run(seconds)
+    except (ValueError, AssertionError) as e:
+        # crosscheck raises AssertionError the first second its two sides disagree
+        error = str(e).splitlines()[0]
+    return error, circuit.time, circuit.summary(), kernel.pack_state(circuit)
+
+
+def same_result(a, b):
+    return a[:3] == b[:3] and len(a[3]) == len(b[3]) and all(np.array_equal(x, y) for x, y in zip(a[3], b[3]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.engines',
+                                     description='Check that every engine matches the tick engine.')
+    parser.add_argument('--cases', type=int, default=200, help='random layouts to try')
+    parser.add_argument('--seconds', type=int, default=7200, help='simulated seconds per run')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    engines = [engine for engine in ENGINES if engine != 'numba' or kernel.HAVE_NUMBA]
+    rng = random.Random(args.seed)
+    mismatches = 0
+    errors = 0
+    for case in range(args.cases):
+        block_ref_dict, num_trains, optional_params = random_case(rng)
+        reference = run_case(block_ref_dict, num_trains, dict(optional_params, engine='tick'), args.seconds)
+        errors += reference[0] is not None
+        for engine in engines:
+            result = run_case(block_ref_dict, num_trains, dict(optional_params, **ENGINES[engine]), args.seconds)
+            if not same_result(reference, result):
+                mismatches += 1
+                print(f"case {case}: {engine} differs from tick ({num_trains} trains, {optional_params})\n"
+                      f"    tick: {reference[0]} at t={reference[1]}\n    {engine}: {result[0]} at t={result[1]}")
+    print(f"{args.cases} cases ({errors} ending in an error) on tick and {', '.join(engines)}: {mismatches} mismatches")
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,95 @@
+"""
+Benchmark layouts module - Alex Borger
+
+Reference layouts for the benchmarks.  Each entry of BENCHMARKS maps a name to a function returning
+(block_ref_dict, num_trains, optional_params), so every run gets a fresh copy.
+"""
+
+
+def make_block(next_block, seconds_to_reach_block, seconds_to_clear_from_held, seconds_to_clear_block_in_motion,
+               hold_time=None):
+    """ plain block with no switches.  a hold_time makes it a station """
+    return {
+        'next_block': next_block,
+        'seconds_to_reach_block': seconds_to_reach_block,
+        'seconds_to_clear_from_held': seconds_to_clear_from_held,
+        'seconds_to_clear_block_in_motion': None if hold_time else seconds_to_clear_block_in_motion,
+        'is_occupied': False,
+        'can_operate_from_stop': True,
+        'mandatory_hold': bool(hold_time),
+        'hold_time': hold_time,
+        'has_merger_switch': False,
+        'has_splitter_switch': False
+    }
+
+
+def sluggish_params(completion_blocks):
+    return {
+        'sluggishness': True,
+        'sluggishness_mu': 1.5,
+        'sluggishness_sigma': 0.6,
+        'random_seed': 10,
+        'circuit_completion_blocks': completion_blocks
+    }
+
+
+def single_station():
+    """ one station, a lift and three more blocks, two trains """
+    blocks = {
+        'station': make_block('lift', 8, 6, None, hold_time=35),
+        'lift': make_block('gravity 1', 18, 8, 7),
+        'gravity 1': make_block('gravity 2', 30, 6, 3),
+        'gravity 2': make_block('final block', 22, 6, 3),
+        'final block': make_block('station', 8, 6, 3)
+    }
+    return blocks, 2, sluggish_params(['station'])
+
+
+def dual_station():
+    """ the layout from sim_tests.py: two stations feeding a merger, with a splitter on the final block """
+    blocks = {
+        'station 1': make_block('lift 1', 8, 6, None, hold_time=33),
+        'station 2': make_block('lift 1', 8, 6, None, hold_time=38),
+        'lift 1': make_block('gravity 1', 18, 8, 7),
+        'gravity 1': make_block('lift 2', 30, 6, 3),
+        'lift 2': make_block('gravity 2', 20, 8, 7),
+        'gravity 2': make_block('final block 1', 22, 6, 3),
+        'final block 1': make_block('station 1', 8, 6, 3)
+    }
+    blocks['lift 1'].update({
+        'has_merger_switch': True,
+        'merger_block_a': 'station 1',
+        'merger_block_b': 'station 2',
+        'corresponding_splitter_block': 'final block 1',
+        'seconds_to_clear_merger': 2,
+        'seconds_merger_to_block': 16
+    })
+    blocks['final block 1'].update({
+        'has_splitter_switch': True,
+        'splitter_block_a': 'station 1',
+        'splitter_block_b': 'station 2',
+        'corresponding_merger_block': 'lift 1'
+    })
+    return blocks, 4, sluggish_params(['station 1', 'station 2'])
+
+
+def long_circuit(num_blocks=60, num_trains=6):
+    """ one station followed by num_blocks - 1 short blocks """
+    names = ['station'] + [f'block {i}' for i in range(1, num_blocks)]
+    blocks = {'station': make_block(names[1], 8, 6, None, hold_time=35)}
+    for i in range(1, num_blocks):
+        blocks[names[i]] = make_block(names[(i + 1) % num_blocks], 10 + i % 7, 6, 3)
+    return blocks, num_trains, sluggish_params(['station'])
+
+
+def many_trains():
+    """ the long circuit with a train on every third block """
+    return long_circuit(num_blocks=60, num_trains=20)
+
+
+BENCHMARKS = {
+    'single_station': single_station,
+    'dual_station': dual_station,
+    'long_circuit': long_circuit,
+    'many_trains': many_trains
+}
@@ -5,12 +5,33 @@ For now, this contains the structure of a block zone.  In the future, this can h
 abstract away certain safety checks
 
 - we could add a get_next here
+
+Block references are stored both by name (the attributes that mirror block_dict) and by index into Circuit.block_list
+(the *_index attributes, resolved once by resolve_indices()).  The simulation only uses the indices.
 """
 
 
 class Block:
+    __slots__ = (
+        'name', 'index', 'next_block_name', 'next_block_index', 'seconds_to_reach_block', 'seconds_to_clear_from_held',
+        'seconds_to_clear_block_in_motion', 'is_occupied', 'can_operate_from_stop', 'mandatory_hold', 'hold_time',
+        'has_merger_switch', 'merger_switch_position', 'merger_switch_index', 'merger_switch_status',
+        'corresponding_splitter_block', 'corresponding_splitter_index', 'corresponding_merger_block',
+        'seconds_to_clear_merger', 'seconds_merger_to_block', 'merger_block_a', 'merger_block_b',
+        'merger_block_a_index', 'merger_block_b_index', 'has_splitter_switch', 'splitter_block_a', 'splitter_block_b',
+        'splitter_block_a_index', 'splitter_block_b_index', 'splitter_switch_position', 'splitter_switch_status'
+    )
+
     def __init__(self, name, block_dict):
         self.name = name
+        self.index = -1
+        self.next_block_index = -1
+        self.merger_switch_index = -1
+        self.merger_block_a_index = -1
+        self.merger_block_b_index = -1
+        self.corresponding_splitter_index = -1
+        self.splitter_block_a_index = -1
+        self.splitter_block_b_index = -1
         self.next_block_name = block_dict['next_block']
         self.seconds_to_reach_block = block_dict['seconds_to_reach_block']
         self.seconds_to_clear_from_held = block_dict['seconds_to_clear_from_held']
@@ -48,8 +69,22 @@ class Block:
             self.splitter_switch_status = 'in position'  # same as above
             self.corresponding_merger_block = block_dict['corresponding_merger_block']
 
+    def resolve_indices(self, index):
+        """ look up the index of every block this one refers to.  index maps block name -> position in block_list """
+        self.index = index[self.name]
+        self.next_block_index = index[self.next_block_name]
+        if self.has_merger_switch:
+            self.merger_block_a_index = index[self.merger_block_a]
+            self.merger_block_b_index = index[self.merger_block_b]
+            self.merger_switch_index = index[self.merger_switch_position]
+            self.corresponding_splitter_index = index[self.corresponding_splitter_block]
+        if self.has_splitter_switch:
+            self.splitter_block_a_index = index[self.splitter_block_a]
+            self.splitter_block_b_index = index[self.splitter_block_b]
+
     def occupy(self, requester_block=None, override=False):
-        """ train wants to occupy zone
+        """ train wants to occupy zone.  requester_block is the block the train is coming from, by index into
+        Circuit.block_list or by name
         """
         if override:
             self.is_occupied = True
@@ -58,12 +93,11 @@ class Block:
         if self.is_occupied:
             return False
         elif self.has_merger_switch:
-            if not requester_block:
-                raise ValueError("Merger block occupy() called without requester block specified.")
+            requester_index = self.requester_index(requester_block)
             if self.merger_switch_status == 'in motion':
                 return False
             # otherwise, it must be in position
-            if self.merger_switch_position == requester_block:
+            if self.merger_switch_index == requester_index:
                 # we arent occupied and switch is ready and in position from requesting block
                 self.is_occupied = True
                 return True
@@ -74,6 +108,32 @@ class Block:
             self.is_occupied = True
             return True
 
+    def requester_index(self, requester_block):
+        """ index of requester_block (an index or a name) for a merger.  only merger_block_a/b can ask a merger """
+        if isinstance(requester_block, str):
+            if requester_block == self.merger_block_a:
+                return self.merger_block_a_index
+            if requester_block == self.merger_block_b:
+                return self.merger_block_b_index
+            raise ValueError(f"Block {requester_block} asked to occupy merger {self.name} but isn't one of its merger "
+                             f"blocks.")
+        if requester_block is None or requester_block < 0:
+            raise ValueError("Merger block occupy() called without requester block specified.")
+        return requester_block
+
+    def occupy_reject_reason(self, requester_block=None):
+        """ why occupy(requester_block) would be refused right now: 'occupied', 'merger in motion',
+        'wrong switch position', or None if it would be granted.  doesn't change anything
+        """
+        if self.is_occupied:
+            return 'occupied'
+        if self.has_merger_switch:
+            if self.merger_switch_status == 'in motion':
+                return 'merger in motion'
+            if self.merger_switch_index != self.requester_index(requester_block):
+                return 'wrong switch position'
+        return None
+
     def unoccupy(self, override_switch=False):
         """ train is leaving block zone, free it.  if override_switch = True, we will not switch
         """
@@ -89,6 +149,13 @@ class Block:
         else:
             return self.merger_block_b, self.merger_block_a
 
+    def get_merger_switch_indices(self):
+        """ same as get_merger_switch_status, as block indices """
+        if self.merger_switch_index == self.merger_block_a_index:
+            return self.merger_block_a_index, self.merger_block_b_index
+        else:
+            return self.merger_block_b_index, self.merger_block_a_index
+
     def signal_cleared_merger(self, switch):
         # update internal state to the extent we care to
         if switch:
@@ -102,8 +169,10 @@ class Block:
         """
         if self.merger_switch_position == self.merger_block_a:
             self.merger_switch_position = self.merger_block_b
+            self.merger_switch_index = self.merger_block_b_index
         elif self.merger_switch_position == self.merger_block_b:
             self.merger_switch_position = self.merger_block_a
+            self.merger_switch_index = self.merger_block_a_index
         else:
             raise ValueError("toggle_merger_switch encountered invalid self.merger_switch_position!")
 
@@ -111,8 +180,10 @@ class Block:
         if self.splitter_switch_position == self.splitter_block_a:
             self.splitter_switch_position = self.splitter_block_b
             self.next_block_name = self.splitter_block_b
+            self.next_block_index = self.splitter_block_b_index
         elif self.splitter_switch_position == self.splitter_block_b:
             self.splitter_switch_position = self.splitter_block_a
             self.next_block_name = self.splitter_block_a
+            self.next_block_index = self.splitter_block_a_index
         else:
             raise ValueError("toggle_splitter_switch encountered invalid self.splitter_switch_position!")
@@ -12,23 +12,98 @@ Attributes:
     - trains
         - a dictionary of train objects, each responsible for managing their current location and state
     - time (int): current time step of the simulation run (default unit: seconds)
+    - engine (str): 'tick' (default) steps every train once per second, 'event' jumps straight to each train's
+        next state transition (see event_engine.py), about 1.5-2.5x faster.  Both produce identical results for the
+        same layout and seed.
+    - backend (str): how the tick engine runs.  'python' (default), 'numba' for the compiled kernel in kernel.py
+        (falls back to 'python' if Numba is not installed, the fast option by far), or 'crosscheck' to run both and
+        assert they agree every second.  python -m benchmarks.engines checks every engine and backend against tick.
+    - event_log (EventLog or None): structured record of state transitions, enabled with
+        optional_params['event_log'] = <output directory> (see event_log.py).  Call close_event_log() when done.
+        The directory must be empty unless optional_params['event_log_overwrite'] is True.
+    - listeners (list): objects with a record(time, kind, train, block, value) method that get every state transition
+        (event kinds are in event_log.py).  The event log is one; metrics.py has streaming statistics.  Add more with
+        add_listener().
+    - on_fault (str): 'raise' (default) or 'downtime', see downtime.py.  With 'downtime', gridlock and 101 status stop
+        the ride for restart_seconds and the run carries on with the trains back where they started, instead of
+        raising.  breakdown_mtbf adds random breakdowns.  stops lists every (time, stop kind, seconds down).
+
+snapshot() / restore() save and reload the simulation state, and fork() branches a new circuit off the current state,
+e.g. to warm up once and then try several operating strategies from the same point.
 """
 
+import math
+import pickle
+from statistics import NormalDist
+
 import numpy as np
 
 from block import Block
+from downtime import STOP_BREAKDOWN, STOP_GRIDLOCK, STOP_101, RideFault, breakdown_rng, downtime_settings, \
+    downtime_summary, draw_breakdown_gaps
+from event_engine import EventEngine
+from event_log import EventLog, EVENT_BLOCK_ENTERED, EVENT_HELD, EVENT_RELEASED, EVENT_MERGER_SWITCHED, \
+    EVENT_SPLITTER_TOGGLED, EVENT_CIRCUIT_COMPLETED, EVENT_RIDE_STOPPED, EVENT_RIDE_RESTARTED
+import kernel
+from random_streams import DELAY_CHUNK, DelayStreams, delay_settings, draw_delays
+from layout import STATUS_HELD, STATUS_BEFORE_BLOCK, STATUS_AFTER_BLOCK_FROM_HELD, STATUS_AFTER_BLOCK_NOT_HELD
 from train import Train
 
 
+def t_coverage(t, dof):
+    """ P(|T| < t) for Student's t with a whole number of degrees of freedom (Abramowitz and Stegun 26.7.3-4) """
+    theta = math.atan(t / math.sqrt(dof))
+    cos_squared = math.cos(theta) ** 2
+    if dof % 2:
+        term, total = math.cos(theta), 0.0
+        for k in range(1, (dof - 1) // 2 + 1):
+            total += term
+            term *= cos_squared * 2 * k / (2 * k + 1)
+        return 2 / math.pi * (theta + math.sin(theta) * total)
+    term, total = 1.0, 0.0
+    for k in range(1, dof // 2 + 1):
+        total += term
+        term *= cos_squared * (2 * k - 1) / (2 * k)
+    return math.sin(theta) * total
+
+
+def t_quantile(confidence, dof):
+    """ two-sided Student t critical value.  exact (bisection on t_coverage) below 30 degrees of freedom, where the
+    Cornish-Fisher expansion of the normal quantile used above that is too small
+    """
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+    if dof >= 30:
+        return z + (z ** 3 + z) / (4 * dof) + (5 * z ** 5 + 16 * z ** 3 + 3 * z) / (96 * dof ** 2)
+    low, high = z, 2 * z
+    while t_coverage(high, dof) < confidence:
+        low, high = high, 2 * high
+    for _ in range(100):
+        middle = (low + high) / 2
+        if t_coverage(middle, dof) < confidence:
+            low = middle
+        else:
+            high = middle
+    return high
+
+
 class Circuit:
     def __init__(self, block_ref_dict, num_trains, optional_params=None):
+        # kept so fork() can build an identical circuit
+        self.block_ref_dict = block_ref_dict
+        self.optional_params = dict(optional_params or {})
         self.blocks = {}
         for block in block_ref_dict:
             self.blocks[block] = Block(name=block, block_dict=block_ref_dict[block])
+        # blocks and trains are looked up by index while simulating, self.blocks / self.trains are for access by name
+        self.block_list = list(self.blocks.values())
+        block_index = {block: i for i, block in enumerate(self.blocks)}
+        for block in self.block_list:
+            block.resolve_indices(block_index)
         self.num_complete_blocks = self.calculate_complete_blocks()
         self.num_trains = num_trains
         self.trains = {}
         self.add_trains_to_circuit()
+        self.train_list = list(self.trains.values())
         for train in self.trains:
             self.blocks[self.trains[train].current_block].occupy(override=True)
             self.trains[train].history['total_seconds_held'] = {
@@ -41,6 +116,10 @@ class Circuit:
         self.random_seed = 0
         self.circuit_completion_blocks = None
         self.verbose = 0
+        self.engine = 'tick'
+        self.backend = 'python'
+        self.event_log = None
+        self.listeners = []
         if optional_params:
             if 'sluggishness' in optional_params:
                 self.dispatch_sluggishness = optional_params['sluggishness']
@@ -54,7 +133,48 @@ class Circuit:
                 self.verbose = optional_params['verbose']
                 if self.verbose not in [0, 1, 2]:
                     raise ValueError(f'{self.verbose} not a valid verbosity setting.  Must be in [0, 1, 2].')
-        self.rng = np.random.default_rng(self.random_seed)
+            if 'engine' in optional_params:
+                self.engine = optional_params['engine']
+                if self.engine not in ['tick', 'event']:
+                    raise ValueError(f"{self.engine} not a valid engine.  Must be in ['tick', 'event'].")
+            if 'backend' in optional_params:
+                self.backend = optional_params['backend']
+                if self.backend not in ['python', 'numba', 'crosscheck']:
+                    raise ValueError(f"{self.backend} not a valid backend.  Must be in ['python', 'numba', 'crosscheck'].")
+                if self.backend != 'python' and (self.engine != 'tick' or self.verbose):
+                    raise ValueError(f"The {self.backend} backend only supports the tick engine without verbose logging.")
+                if self.backend == 'numba' and not kernel.HAVE_NUMBA:
+                    self.backend = 'python'
+            if optional_params.get('event_log'):
+                if self.backend != 'python':
+                    raise ValueError(f"The {self.backend} backend does not support the event log.")
+                self.event_log = EventLog(optional_params['event_log'], self.blocks, self.trains,
+                                          [train.block_index for train in self.train_list],
+                                          chunk_size=optional_params.get('event_log_chunk_size', 65536),
+                                          overwrite=optional_params.get('event_log_overwrite', False))
+                self.listeners.append(self.event_log)
+        # dispatch delay distribution and random streams, see random_streams.py
+        self.delay_distribution, self.delay_params, self.delay_stream_mode, self.antithetic = \
+            delay_settings(optional_params)
+        if self.delay_stream_mode != 'shared' and self.backend != 'python':
+            raise ValueError(f"The {self.backend} backend only supports shared delay streams.")
+        # stopping and restarting the ride, see downtime.py
+        self.on_fault, self.restart_seconds, self.breakdown_mtbf, self.breakdown_seconds = \
+            downtime_settings(optional_params)
+        self.models_downtime = self.on_fault == 'downtime' or self.breakdown_mtbf is not None
+        self.downtime_seconds = 0
+        self.stop_counts = [0, 0, 0]
+        self.stops = []
+        self.down_until = None
+        self.initial_state = kernel.pack_state(self)
+        self.reset_random_streams()
+        self.completes_circuit = [block in (self.circuit_completion_blocks or []) for block in self.blocks]
+        self.block_params = None
+        if self.backend != 'python':
+            self.block_params = kernel.pack_block_params(self, block_ref_dict)
+        self.event_engine = None
+        if self.engine == 'event':
+            self.event_engine = EventEngine(self)
 
     def calculate_complete_blocks(self):
         return len([b for b in self.blocks if self.blocks[b].can_operate_from_stop])
@@ -70,7 +190,9 @@ class Circuit:
             block = valid_blocks[blocks_to_assign[i]]
             train = {
                 'name': train_name,
+                'index': i,
                 'current_block': block,
+                'block_index': self.blocks[block].index,
                 'next_block_name': self.blocks[block].next_block_name,
                 'seconds_to_reach_block': 0,
                 'seconds_to_clear_from_held': 0,
@@ -84,140 +206,503 @@ class Circuit:
             }
             self.trains[train_name] = Train(train_ref_dict=train)
 
+    def summary(self):
+        """ run metrics as a plain dict: hourly cycles, percent of run time each train sat idle and seconds held per
+        block summed over trains
+        """
+        circuits_completed = sum(self.trains[train].circuits_completed for train in self.trains)
+        total_seconds_held = {block: 0 for block in self.blocks}
+        for train in self.trains:
+            for block, seconds in self.trains[train].history['total_seconds_held'].items():
+                total_seconds_held[block] += seconds
+        summary = {
+            'time': self.time,
+            'num_trains': self.num_trains,
+            'circuits_completed': circuits_completed,
+            'cycles_per_hour': circuits_completed * 3600 / self.time if self.time else 0.0,
+            'idle_percent': {
+                train: round(100 * self.trains[train].total_seconds_held / self.time, 2) if self.time else 0.0
+                for train in self.trains
+            },
+            'total_seconds_held': total_seconds_held
+        }
+        if self.models_downtime:
+            summary['downtime'] = downtime_summary(self.time, circuits_completed, self.downtime_seconds,
+                                                   self.stop_counts)
+        return summary
+
+    def state_key(self):
+        """ hashable snapshot of everything that decides what happens next: where each train is, its status and
+        countdowns, plus block occupancy and switch positions.  self.time and the cumulative counters are left out, so
+        without dispatch delays two equal keys mean the circuit is at the same point of a repeating pattern
+        """
+        # seconds_merger_to_block is left out too, it only ever counts down and doesn't affect movement
+        trains = tuple(
+            (train.block_index, train.status, train.seconds_to_reach_block, train.seconds_to_clear_from_held,
+             train.seconds_to_clear_block_in_motion, train.seconds_to_clear_merger, train.mandatory_hold_left,
+             train.seconds_held_at_current_block)
+            for train in self.train_list
+        )
+        blocks = tuple((block.is_occupied, block.next_block_index, block.merger_switch_index) for block in self.block_list)
+        return trains, blocks
+
+    def snapshot(self):
+        """ compact binary copy of the simulation state: every mutable Train and Block field (packed into arrays the
+        same way as the numba backend), the time, the random stream states and unused dispatch delays, and the downtime
+        state.  see restore() and fork()
+        """
+        trains, held_by_block, block_state = kernel.pack_state(self)
+        streams = self.delay_streams.get_state() if self.delay_streams is not None else None
+        downtime = (self.downtime_seconds, list(self.stop_counts), list(self.stops), self.down_until,
+                    self.next_breakdown, self.breakdown_rng.bit_generator.state)
+        state = (self.time, trains, held_by_block, block_state, self.delays[self.delay_pos:],
+                 self.rng.bit_generator.state, streams, downtime)
+        return pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def restore(self, snapshot):
+        """ put the circuit back into the state saved by snapshot(), taken from this circuit or one built from the same
+        layout and num_trains
+        """
+        time, trains, held_by_block, block_state, delays, rng_state, streams, downtime = pickle.loads(snapshot)
+        kernel.unpack_state(self, trains, held_by_block, block_state)
+        self.time = time
+        self.delays = delays
+        self.delay_pos = 0
+        self.rng.bit_generator.state = rng_state
+        if streams is not None and self.delay_streams is not None:
+            self.delay_streams.set_state(streams)
+        self.downtime_seconds, self.stop_counts, self.stops, self.down_until, self.next_breakdown, breakdown_state = \
+            downtime
+        self.stop_counts = list(self.stop_counts)
+        self.stops = list(self.stops)
+        self.breakdown_rng.bit_generator.state = breakdown_state
+        if self.breakdown_mtbf is None:
+            self.next_breakdown = None
+        elif self.next_breakdown is None and self.down_until is None:
+            self.next_breakdown = self.time + self.next_breakdown_gap()
+        if self.event_engine is not None:
+            # the event queue is rebuilt from the restored trains
+            self.event_engine = EventEngine(self)
+
+    def fork(self, optional_params=None, snapshot=None):
+        """ new circuit that carries on from this one's current state (or from snapshot, if given).
+        optional_params override the ones this circuit was built with, e.g. a different engine or sluggishness.
+        a new random_seed starts a fresh random stream instead of continuing this one's.
+        the fork doesn't write to this circuit's event log unless it is given one, and starts with no other listeners
+        """
+        params = dict(self.optional_params)
+        params.pop('event_log', None)
+        params.update(optional_params or {})
+        circuit = Circuit(block_ref_dict=self.block_ref_dict, num_trains=self.num_trains, optional_params=params)
+        circuit.restore(snapshot or self.snapshot())
+        if optional_params and 'random_seed' in optional_params:
+            circuit.reset_random_streams()
+        return circuit
+
+    def reset_random_streams(self):
+        """ start the dispatch delays over from self.random_seed """
+        self.rng = np.random.default_rng(self.random_seed)
+        # shared mode: delays are drawn from self.rng in bulk, see next_delay()
+        self.delays = np.zeros(0, dtype=np.int64)
+        self.delay_pos = 0
+        self.delay_streams = None
+        # station / train mode: stream index of each block / train
+        self.delay_stream_of = None
+        if self.delay_stream_mode == 'station':
+            stations = [block for block in self.block_list if block.mandatory_hold]
+            self.delay_stream_of = [-1] * len(self.block_list)
+            for stream, block in enumerate(stations):
+                self.delay_stream_of[block.index] = stream
+            keys = [block.name for block in stations]
+        elif self.delay_stream_mode == 'train':
+            self.delay_stream_of = list(range(self.num_trains))
+            keys = [train.name for train in self.train_list]
+        if self.delay_stream_of is not None:
+            self.delay_streams = DelayStreams(self.random_seed, keys, self.delay_distribution, self.delay_params,
+                                              self.antithetic)
+        # breakdowns have a stream of their own, so they don't shift the dispatch delays
+        self.breakdown_rng = breakdown_rng(self.random_seed)
+        self.next_breakdown = None
+        if self.breakdown_mtbf is not None and self.down_until is None:
+            self.next_breakdown = self.time + self.next_breakdown_gap()
+
+    def next_breakdown_gap(self):
+        return int(draw_breakdown_gaps(self.breakdown_rng, self.breakdown_mtbf, 1)[0])
+
+    def refill_delays(self):
+        """ top up the shared dispatch delay buffer with DELAY_CHUNK more draws from self.rng """
+        delays = draw_delays(self.rng, self.delay_distribution, self.delay_params, DELAY_CHUNK, self.antithetic)
+        self.delays = np.concatenate([self.delays[self.delay_pos:], delays])
+        self.delay_pos = 0
+
+    def next_delay(self, train=-1, block=-1):
+        """ next dispatch delay in seconds for train (index) stopping at block (index).  in shared mode this is the
+        same sequence as drawing round(self.rng.lognormal(...)) one at a time
+        """
+        if self.delay_streams is not None:
+            key = block if self.delay_stream_mode == 'station' else train
+            return self.delay_streams.next(self.delay_stream_of[key])
+        if self.delay_pos >= len(self.delays):
+            self.refill_delays()
+        delay = self.delays[self.delay_pos]
+        self.delay_pos += 1
+        return int(delay)
+
+    def add_listener(self, listener):
+        """ send every state transition to listener.record(time, kind, train, block, value) from now on.
+        returns the listener
+        """
+        if self.backend != 'python':
+            raise ValueError(f"The {self.backend} backend does not support listeners.")
+        self.listeners.append(listener)
+        return listener
+
+    def emit(self, kind, train, block, value=0):
+        for listener in self.listeners:
+            listener.record(self.time, kind, train, block, value)
+
+    def close_event_log(self):
+        """ write out any events still buffered in memory """
+        if self.event_log is not None:
+            self.event_log.close()
+
     def step(self):
-        trains_advanced = 0
+        """ advance the simulation by one second """
+        if self.engine == 'event' or self.backend != 'python' or self.models_downtime:
+            self.run(1)
+        else:
+            self.tick()
+
+    def tick(self):
+        """ one second of the Python tick engine """
         trains_blocked = 0
         # advance each train if possible
-        for train_name in self.trains:
-            curr_block = self.trains[train_name].current_block
-            next_block = self.blocks[curr_block].next_block_name  # self.trains[train_name].next_block_name
-            if self.trains[train_name].current_status == 'held':
-                # do a thing because they are held rn
-                if self.trains[train_name].mandatory_hold_left > 0:
-                    # held and not ready to go
-                    self.trains[train_name].mandatory_hold_left -= 1
+        for i in range(self.num_trains):
+            if self.step_train(i):
+                trains_blocked += 1
+        if trains_blocked == self.num_trains:
+            # we hit gridlock
+            raise RideFault(STOP_GRIDLOCK, f"Gridlock hit at t={self.time}!")
+        self.time += 1
+
+    def run(self, seconds, until_completion=False):
+        """ advance the simulation by `seconds` seconds with the engine chosen at construction.  with downtime
+        modelled, the ride is stopped on faults (with on_fault='downtime') and breakdowns, and restarted once its
+        downtime is over.
+        until_completion stops early at the end of the first second a train completes a circuit.  returns True if it
+        did
+        """
+        if not self.models_downtime:
+            return self.advance(seconds, until_completion)
+        end = self.time + seconds
+        while self.time < end:
+            if self.down_until is not None:
+                down = min(self.down_until, end) - self.time
+                self.time += down
+                self.downtime_seconds += down
+                if self.time == self.down_until:
+                    self.restart()
+                continue
+            until = end if self.next_breakdown is None else min(end, self.next_breakdown)
+            try:
+                completed = self.advance(until - self.time, until_completion)
+            except RideFault as e:
+                if self.on_fault != 'downtime':
+                    raise
+                self.stop(e.kind, self.restart_seconds)
+                continue
+            if self.time == self.next_breakdown:
+                self.stop(STOP_BREAKDOWN, self.breakdown_seconds)
+            if completed:
+                return True
+        return False
+
+    def stop(self, kind, seconds):
+        """ stop the ride now for seconds.  kind is one of downtime.STOP_KINDS """
+        self.stop_counts[kind] += 1
+        self.stops.append((self.time, kind, seconds))
+        self.down_until = self.time + seconds
+        self.next_breakdown = None
+        if self.listeners:
+            self.emit(EVENT_RIDE_STOPPED, -1, -1, kind)
+
+    def restart(self):
+        """ end of downtime: every train back in the block it started the run in, switches back to their starting
+        positions.  circuits completed and seconds held are kept
+        """
+        trains, held_by_block, _ = kernel.pack_state(self)
+        initial_trains, _, initial_block_state = self.initial_state
+        counters = [kernel.T_TOTAL_HELD, kernel.T_CIRCUITS]
+        restarted = initial_trains.copy()
+        restarted[:, counters] = trains[:, counters]
+        kernel.unpack_state(self, restarted, held_by_block, initial_block_state.copy())
+        self.down_until = None
+        if self.breakdown_mtbf is not None:
+            self.next_breakdown = self.time + self.next_breakdown_gap()
+        if self.event_engine is not None:
+            self.event_engine = EventEngine(self)
+        if self.listeners:
+            self.emit(EVENT_RIDE_RESTARTED, -1, -1)
+
+    def advance(self, seconds, until_completion=False):
+        """ run the engine for seconds, raising on gridlock / 101 status.  see run() for until_completion """
+        if self.backend == 'numba':
+            return kernel.run_compiled(self, seconds, until_completion)
+        if until_completion:
+            # the other engines can't stop mid-run, so go a second at a time
+            completions = self.circuits_completed()
+            for _ in range(seconds):
+                self.advance(1)
+                if self.circuits_completed() != completions:
+                    return True
+            return False
+        if self.backend == 'crosscheck':
+            kernel.crosscheck(self, seconds)
+        elif self.engine == 'event':
+            self.event_engine.run_until(self.time + seconds)
+        else:
+            for _ in range(seconds):
+                self.tick()
+        return False
+
+    def circuits_completed(self):
+        """ circuits completed by all trains together """
+        return sum(train.circuits_completed for train in self.train_list)
+
+    def run_until_converged(self, precision=0.01, confidence=0.95, batch_seconds=3600, warmup_seconds=None,
+                            min_batches=5, max_seconds=360000):
+        """ run until cycles per hour is known, instead of for a fixed time.
+
+        without sluggishness (or breakdowns) the circuit is deterministic and settles into a repeating pattern: the
+        state is hashed after every circuit completion and the run stops the first time a state repeats, which gives
+        the exact rate, downtime from faults included.  with sluggishness or breakdowns, the first warmup_seconds
+        (default one batch) are discarded and the rest is cut into batch_seconds batches.  the run stops once the
+        confidence interval of the mean hourly rate over the batches is within +/- precision (relative) of the mean.
+        max_seconds and warmup_seconds count from the call, so a forked or already warm circuit gets the full budget.
+
+        returns a dict with cycles_per_hour, half_width of its confidence interval (0 for the exact rate),
+        warmup_seconds discarded, converged (False if max_seconds was hit first), and period_seconds or batches
+        depending on the mode
+        """
+        start = self.time
+        deadline = start + max_seconds
+        completions = initial_completions = self.circuits_completed()
+        if not self.dispatch_sluggishness and self.breakdown_mtbf is None:
+            seen = {}
+            while self.time < deadline:
+                if not self.run(deadline - self.time, until_completion=True):
+                    continue
+                completions = self.circuits_completed()
+                key = self.state_key()
+                if key in seen:
+                    start_time, start_completions = seen[key]
+                    period = self.time - start_time
+                    return {
+                        'mode': 'periodic',
+                        'converged': True,
+                        'cycles_per_hour': (completions - start_completions) * 3600 / period,
+                        'half_width': 0.0,
+                        'warmup_seconds': start_time - start,
+                        'period_seconds': period,
+                        'cycles_per_period': completions - start_completions
+                    }
+                seen[key] = (self.time, completions)
+            return {
+                'mode': 'periodic',
+                'converged': False,
+                'cycles_per_hour': (completions - initial_completions) * 3600 / (self.time - start) if self.time > start
+                else 0.0,
+                'half_width': None,
+                'warmup_seconds': None,
+                'period_seconds': None,
+                'cycles_per_period': None
+            }
+        if warmup_seconds is None:
+            warmup_seconds = batch_seconds
+        self.run(warmup_seconds)
+        completions = self.circuits_completed()
+        batches = []
+        mean, half_width = 0.0, float('inf')
+        while self.time + batch_seconds <= deadline:
+            self.run(batch_seconds)
+            total = self.circuits_completed()
+            batches.append((total - completions) * 3600 / batch_seconds)
+            completions = total
+            n = len(batches)
+            mean = sum(batches) / n
+            if n < max(min_batches, 2):
+                continue
+            variance = sum((x - mean) ** 2 for x in batches) / (n - 1)
+            half_width = t_quantile(confidence, n - 1) * (variance / n) ** 0.5
+            if half_width <= precision * mean:
+                break
+        return {
+            'mode': 'batch means',
+            'converged': half_width <= precision * mean,
+            'cycles_per_hour': mean,
+            'half_width': half_width,
+            'warmup_seconds': warmup_seconds,
+            'batches': len(batches)
+        }
+
+    def step_train(self, i):
+        """ apply one second of the block state machine to train i (its index in self.train_list) at self.time.
+        returns True if the train was blocked from advancing this second
+        """
+        blocked = False
+        train = self.train_list[i]
+        curr = train.block_index
+        block = self.block_list[curr]
+        if train.status == STATUS_HELD:
+            # do a thing because they are held rn
+            if train.mandatory_hold_left > 0:
+                # held and not ready to go
+                train.mandatory_hold_left -= 1
+            else:
+                # held and ready to go
+                # is the next block ready?
+                if not self.block_list[block.next_block_index].occupy(curr):
+                    # we cannot go anywhere
+                    if not block.can_operate_from_stop:
+                        # TODO: signal to all other trains to stop at the next possible block.
+                        raise RideFault(STOP_101, f"Train {train.name} halted at block {block.name}. "
+                                        f"Ride is now in 101 status.")
+                    train.seconds_held_at_current_block += 1
+                    train.total_seconds_held += 1
+                    train.history['total_seconds_held'][block.name] += 1
+                    blocked = True
+                else:
+                    # we can proceed but from held position
+                    train.seconds_to_clear_from_held = block.seconds_to_clear_from_held - 1
+                    train.status = STATUS_AFTER_BLOCK_FROM_HELD
+                    if self.listeners:
+                        self.emit(EVENT_RELEASED, i, curr, train.seconds_held_at_current_block)
+        # elif/else... means we are in motion.  EITHER: seconds_to_reach_block > 0 (we haven't reached our own block yet), OR
+        # seconds_to_clear_from_held > 0 (we were held and were recently released), OR seconds_to_clear_block_in_motion > 0 (we reached
+        # our own block but haven't exited it yet).  Only ONE of these should be > 0 at any given time. if all are 0...
+        elif train.seconds_to_reach_block > 0:
+            # if we haven't reached block yet, check if we cleared merger
+            if block.has_merger_switch:
+                if train.seconds_to_clear_merger > 0:
+                    train.seconds_to_clear_merger -= 1
+                    if train.seconds_to_clear_merger == 0 and self.num_trains > 1:
+                        # let block decide if it wants to activate merge switch
+                        self.clear_merger(block)
+                else:
+                    # not sure if this attribute is really needed
+                    train.seconds_merger_to_block -= 1
+            train.seconds_to_reach_block -= 1
+        elif train.seconds_to_clear_from_held > 0:
+            # we were held, decrease this
+            train.seconds_to_clear_from_held -= 1
+        elif train.seconds_to_clear_block_in_motion > 0:
+            # we are past our own block, never stopped at it either
+            train.seconds_to_clear_block_in_motion -= 1
+        else:
+            # 'before block', 'after block - from held', 'after block - not held'
+            # we either reached the block OR are ready to exit it
+            if train.status == STATUS_BEFORE_BLOCK:
+                # we hadn't reached the block and now we either have to keep moving from motion or stop
+                if block.mandatory_hold:
+                    # we reached station (or show scene? transfer track? etc... and must pause
+                    train.status = STATUS_HELD
+                    train.mandatory_hold_left = block.hold_time
+                    if self.dispatch_sluggishness:
+                        delay = self.next_delay(i, curr)
+                        train.mandatory_hold_left += delay
+                    train.mandatory_hold_left -= 1
+                    if self.listeners:
+                        self.emit(EVENT_HELD, i, curr, train.mandatory_hold_left + 1)
                 else:
-                    # held and ready to go
-                    # is the next block ready?
-                    if not self.blocks[next_block].occupy(requester_block=curr_block):
-                        # we cannot go anywhere
-                        if not self.blocks[curr_block].can_operate_from_stop:
+                    if not self.block_list[block.next_block_index].occupy(curr):
+                        # this means another train is there! we cannot proceed.
+                        # mark train as held
+                        train.status = STATUS_HELD
+                        blocked = True
+                        if self.listeners:
+                            self.emit(EVENT_HELD, i, curr)
+                        if not block.can_operate_from_stop:
                             # TODO: signal to all other trains to stop at the next possible block.
-                            raise ValueError(f"Train {train_name} halted at block {curr_block}. Ride is now in 101 status.")
-                        self.trains[train_name].seconds_held_at_current_block += 1
-                        self.trains[train_name].total_seconds_held += 1
-                        self.trains[train_name].history['total_seconds_held'][curr_block] += 1
-                        trains_blocked += 1
+                            raise RideFault(STOP_101, f"Train {train.name} halted at block {block.name}. "
+                                            f"Ride is now in 101 status.")
+                        train.seconds_held_at_current_block += 1
                     else:
-                        # we can proceed but from held position
-                        self.trains[train_name].seconds_to_clear_from_held = self.blocks[curr_block].seconds_to_clear_from_held
-                        self.trains[train_name].current_status = 'after block - from held'
-                        self.trains[train_name].seconds_to_clear_from_held -= 1
-            # elif/else... means we are in motion.  EITHER: seconds_to_reach_block > 0 (we haven't reached our own block yet), OR
-            # seconds_to_clear_from_held > 0 (we were held and were recently released), OR seconds_to_clear_block_in_motion > 0 (we reached
-            # our own block but haven't exited it yet).  Only ONE of these should be > 0 at any given time. if all are 0...
-            elif self.trains[train_name].seconds_to_reach_block > 0:
-                # if we haven't reached block yet, check if we cleared merger
-                if self.blocks[curr_block].has_merger_switch:
-                    if self.trains[train_name].seconds_to_clear_merger > 0:
-                        self.trains[train_name].seconds_to_clear_merger -= 1
-                        if self.trains[train_name].seconds_to_clear_merger == 0 and self.num_trains > 1:
-                            # let block decide if it wants to activate merge switch
-                            active_block, inactive_block = self.blocks[curr_block].get_merger_switch_status()
-                            # if we know the next dispatch is going to be from the inactive block, switch it.
-                            # TODO: Implement above. If both stations are empty, merger should anticipate taking
-                            # train from whichever station the splitter is going to send a train to
-                            # if exactly one is occupied, it should point to the occupied block
-                            # if both are occupied, it should take from the train that will dispatch sooner, or in a
-                            # dead tie, do nothing
-                            active_block_occupied = self.blocks[active_block].is_occupied
-                            inactive_block_occupied = self.blocks[inactive_block].is_occupied
-                            # TODO: If this is the best implementation, simplify
-                            switch = False
-                            if not active_block_occupied and not inactive_block_occupied:
-                                # neither are occupied, point to wherever the splitter is pointing
-                                corr_splitter_block = self.blocks[curr_block].corresponding_splitter_block
-                                if self.blocks[corr_splitter_block].splitter_switch_position == inactive_block:
-                                    switch = True
-                            elif active_block_occupied and not inactive_block_occupied:
-                                # we shouldn't do anything
-                                # self.blocks[curr_block].signal_cleared_merger(switch=False)
-                                switch = False
-                            elif not active_block_occupied and inactive_block_occupied:
-                                # we need to switch to the other
-                                switch = True
-                            else:
-                                # both are occupied
-                                switch = False
-                            self.blocks[curr_block].signal_cleared_merger(switch=switch)
-                    else:
-                        # not sure if this attribute is really needed
-                        self.trains[train_name].seconds_merger_to_block -= 1
-                self.trains[train_name].seconds_to_reach_block -= 1
-            elif self.trains[train_name].seconds_to_clear_from_held > 0:
-                # we were held, decrease this
-                self.trains[train_name].seconds_to_clear_from_held -= 1
-            elif self.trains[train_name].seconds_to_clear_block_in_motion > 0:
-                # we are past our own block, never stopped at it either
-                self.trains[train_name].seconds_to_clear_block_in_motion -= 1
+                        # we were moving, reached block and are cleared to move forward
+                        train.seconds_to_clear_block_in_motion = block.seconds_to_clear_block_in_motion
+                        train.status = STATUS_AFTER_BLOCK_NOT_HELD
+                        train.seconds_to_clear_block_in_motion -= 1
+                # if next block already belongs to us, that means we already reached our block and are proceeding forward
             else:
-                # 'before block', 'after block - from held', 'after block - not held'
-                # we either reached the block OR are ready to exit it
-                if self.trains[train_name].current_status == 'before block':
-                    # we hadn't reached the block and now we either have to keep moving from motion or stop
-                    if self.blocks[curr_block].mandatory_hold:
-                        # we reached station (or show scene? transfer track? etc... and must pause
-                        self.trains[train_name].current_status = 'held'
-                        self.trains[train_name].mandatory_hold_left = self.blocks[curr_block].hold_time
-                        if self.dispatch_sluggishness:
-                            delay = round(self.rng.lognormal(mean=1.5, sigma=0.6))
-                            self.trains[train_name].mandatory_hold_left += delay
-                        self.trains[train_name].mandatory_hold_left -= 1
-                    else:
-                        if not self.blocks[next_block].occupy(requester_block=curr_block):
-                        # this means another train is there! we cannot proceed.
-                        # mark train as held
-                            self.trains[train_name].current_status = 'held'
-                            trains_blocked += 1
-                            if not self.blocks[curr_block].can_operate_from_stop:
-                                # TODO: signal to all other trains to stop at the next possible block.
-                                raise ValueError(f"Train {train_name} halted at block {curr_block}. Ride is now in 101 status.")
-                            self.trains[train_name].seconds_held_at_current_block += 1
-                        else:
-                            # we were moving, reached block and are cleared to move forward
-                            self.trains[train_name].seconds_to_clear_block_in_motion = self.blocks[curr_block].seconds_to_clear_block_in_motion
-                            self.trains[train_name].current_status = 'after block - not held'
-                            self.trains[train_name].seconds_to_clear_block_in_motion -= 1
-                    # if next block already belongs to us, that means we already reached our block and are proceeding forward
-                else:
-                    # we reached end of block from motion OR stopped, either way... advance to next block
-                    # we already own the next block, no need to check or alter it
-                    # release current block
-                    self.trains[train_name].current_block = next_block
-                    self.trains[train_name].next_block_name = self.blocks[next_block].next_block_name
-                    self.trains[train_name].seconds_to_reach_block = self.blocks[next_block].seconds_to_reach_block
-                    self.trains[train_name].seconds_to_reach_block -= 1
-                    self.trains[train_name].seconds_to_clear_merger = self.blocks[next_block].seconds_to_clear_merger
-                    if self.trains[train_name].seconds_to_clear_merger > 0:
-                        self.trains[train_name].seconds_to_clear_merger -= 1
-                    self.trains[train_name].seconds_held_at_current_block = 0
-                    self.trains[train_name].current_status = 'before block'
-                    self.blocks[curr_block].unoccupy(override_switch=(self.num_trains == 1))
-                    if self.circuit_completion_blocks:
-                        if next_block in self.circuit_completion_blocks:
-                            self.trains[train_name].circuits_completed += 1
-                            #if trains[train_name]['lead_train']:
-                            #    print("Lead train completed circuit!")
-                            trains_advanced += 1
-            if self.verbose == 2 or (self.verbose == 1 and self.trains[train_name].lead_train):
-                # add current_status
-                log_params = []
-                log_params.append(f"t={self.time}")
-                log_params.append(f"{train_name}: {self.trains[train_name].current_block}")
-                log_params.append(f"status: {self.trains[train_name].current_status}")
-                log_params.append(f"seconds held at current block: {self.trains[train_name].seconds_held_at_current_block}")
-                print(', '.join([p for p in log_params]))
-        if trains_blocked == self.num_trains:
-            # we hit gridlock
-            raise ValueError(f"Gridlock hit at t={self.time}!")
-        self.time += 1
+                # we reached end of block from motion OR stopped, either way... advance to next block
+                # we already own the next block, no need to check or alter it
+                # release current block
+                next_index = block.next_block_index
+                next_block = self.block_list[next_index]
+                train.block_index = next_index
+                train.current_block = next_block.name
+                train.next_block_name = next_block.next_block_name
+                train.seconds_to_reach_block = next_block.seconds_to_reach_block - 1
+                train.seconds_to_clear_merger = next_block.seconds_to_clear_merger
+                if train.seconds_to_clear_merger > 0:
+                    train.seconds_to_clear_merger -= 1
+                train.seconds_held_at_current_block = 0
+                train.status = STATUS_BEFORE_BLOCK
+                block.unoccupy(override_switch=(self.num_trains == 1))
+                if self.completes_circuit[next_index]:
+                    train.circuits_completed += 1
+                if self.listeners:
+                    self.emit_block_exit(i, block, next_index)
+                    #if trains[train_name]['lead_train']:
+                    #    print("Lead train completed circuit!")
+        if self.verbose == 2 or (self.verbose == 1 and train.lead_train):
+            self.log_train(train)
+        return blocked
+
+    def log_train(self, train):
+        # add current_status
+        log_params = []
+        log_params.append(f"t={self.time}")
+        log_params.append(f"{train.name}: {train.current_block}")
+        log_params.append(f"status: {train.current_status}")
+        log_params.append(f"seconds held at current block: {train.seconds_held_at_current_block}")
+        print(', '.join([p for p in log_params]))
+
+    def clear_merger(self, block):
+        """ a train just cleared the merger switch of block.  decide whether to point the merger at the other station """
+        active, inactive = block.get_merger_switch_indices()
+        # if we know the next dispatch is going to be from the inactive block, switch it.
+        # TODO: Implement above. If both stations are empty, merger should anticipate taking
+        # train from whichever station the splitter is going to send a train to
+        # if exactly one is occupied, it should point to the occupied block
+        # if both are occupied, it should take from the train that will dispatch sooner, or in a
+        # dead tie, do nothing
+        active_block_occupied = self.block_list[active].is_occupied
+        inactive_block_occupied = self.block_list[inactive].is_occupied
+        # TODO: If this is the best implementation, simplify
+        switch = False
+        if not active_block_occupied and not inactive_block_occupied:
+            # neither are occupied, point to wherever the splitter is pointing
+            corr_splitter_block = self.block_list[block.corresponding_splitter_index]
+            if corr_splitter_block.next_block_index == inactive:
+                switch = True
+        elif active_block_occupied and not inactive_block_occupied:
+            # we shouldn't do anything
+            switch = False
+        elif not active_block_occupied and inactive_block_occupied:
+            # we need to switch to the other
+            switch = True
+        else:
+            # both are occupied
+            switch = False
+        block.signal_cleared_merger(switch=switch)
+        if switch and self.listeners:
+            self.emit(EVENT_MERGER_SWITCHED, -1, block.index, block.merger_switch_index)
+
+    def emit_block_exit(self, i, block, next_index):
+        """ events for train i leaving block for next_index """
+        train = self.train_list[i]
+        self.emit(EVENT_BLOCK_ENTERED, i, next_index)
+        if block.has_splitter_switch and self.num_trains > 1:
+            self.emit(EVENT_SPLITTER_TOGGLED, -1, block.index, block.next_block_index)
+        if self.completes_circuit[next_index]:
+            self.emit(EVENT_CIRCUIT_COMPLETED, i, next_index, train.circuits_completed)
@@ -0,0 +1,82 @@
+"""
+Downtime module - Alex Borger
+
+What happens when the ride stops: gridlock, 101 status and random breakdowns.
+
+optional_params keys, shared by Circuit and BatchCircuit:
+    - on_fault: 'raise' (default) ends the run with a ValueError on gridlock or 101 status.  'downtime' stops the ride
+        instead: nothing moves for restart_seconds, then every train is put back in the block it started the run in
+        (trains evacuated and the ride restarted) and the run carries on.  Cumulative counters (circuits completed,
+        seconds held) are kept.
+    - restart_seconds: seconds from a fault to the ride running again (default 900)
+    - breakdown_mtbf: mean running seconds between random breakdowns (exponentially distributed).  None (default) for
+        no breakdowns.  A breakdown stops the ride the same way as a fault, whatever on_fault is.
+    - breakdown_seconds: seconds a breakdown keeps the ride down (default restart_seconds)
+Breakdowns are drawn from their own random stream (seeded from random_seed), so turning them on doesn't change the
+dispatch delays.  The next breakdown is drawn when the ride (re)starts.
+
+Runs that model downtime add a 'downtime' entry to their summary (see downtime_summary) with the capacity lost.
+
+Every engine raises gridlock and 101 status as RideFault, a ValueError that carries the STOP_* kind, so they can be
+told apart from other errors without reading the message.
+"""
+
+import numpy as np
+
+from random_streams import stream_rng
+
+FAULT_MODES = ['raise', 'downtime']
+STOP_GRIDLOCK = 0
+STOP_101 = 1
+STOP_BREAKDOWN = 2
+STOP_KINDS = ['gridlock', '101 status', 'breakdown']
+
+
+def downtime_settings(optional_params):
+    """ (on_fault, restart_seconds, breakdown_mtbf, breakdown_seconds) from optional_params """
+    optional_params = optional_params or {}
+    on_fault = optional_params.get('on_fault', 'raise')
+    if on_fault not in FAULT_MODES:
+        raise ValueError(f"{on_fault} not a valid on_fault setting.  Must be in {FAULT_MODES}.")
+    restart_seconds = optional_params.get('restart_seconds', 900)
+    breakdown_mtbf = optional_params.get('breakdown_mtbf')
+    breakdown_seconds = optional_params.get('breakdown_seconds', restart_seconds)
+    if restart_seconds < 1 or breakdown_seconds < 1:
+        raise ValueError("restart_seconds and breakdown_seconds must be at least 1.")
+    if breakdown_mtbf is not None and breakdown_mtbf <= 0:
+        raise ValueError("breakdown_mtbf must be positive.")
+    return on_fault, restart_seconds, breakdown_mtbf, breakdown_seconds
+
+
+def breakdown_rng(random_seed):
+    return stream_rng(random_seed, 'breakdowns')
+
+
+def draw_breakdown_gaps(rng, mtbf, size):
+    """ size whole-second gaps from a (re)start to the next breakdown, at least 1 """
+    return np.maximum(np.round(rng.exponential(mtbf, size)), 1).astype(np.int64)
+
+
+class RideFault(ValueError):
+    """ the ride can't carry on: gridlock or 101 status.  kind is STOP_GRIDLOCK or STOP_101 """
+    def __init__(self, kind, message):
+        super().__init__(message)
+        self.kind = kind
+
+    def __reduce__(self):
+        return RideFault, (self.kind, str(self))
+
+
+def downtime_summary(time, circuits_completed, downtime_seconds, stop_counts):
+    """ the 'downtime' entry of a summary.  cycles_lost is what the ride would have done at its running rate during
+    the downtime
+    """
+    running = time - downtime_seconds
+    running_rate = circuits_completed * 3600 / running if running else 0.0
+    return {
+        'seconds': downtime_seconds,
+        'percent': round(100 * downtime_seconds / time, 2) if time else 0.0,
+        'stops': dict(zip(STOP_KINDS, stop_counts)),
+        'cycles_per_hour_running': running_rate,
+        'cycles_lost': running_rate * downtime_seconds / 3600
+    }
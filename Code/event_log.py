@@ -0,0 +1,128 @@
+"""
+Event log module - Alex Borger
+
+Structured record of state transitions, as an alternative to verbose printing.
+
+Only transitions are recorded, one row per event with the columns in COLUMNS:
+    - time: second the event happened
+    - kind: one of the EVENT_* codes below
+    - train: index into circuit.train_list (-1 for block and ride events)
+    - block: index into circuit.block_list (-1 for ride events)
+    - value: depends on kind
+        - block entered: 0
+        - held: seconds of mandatory hold (including dispatch delay), 0 when held by an occupied block
+        - released: seconds the train waited on an occupied block before release
+        - merger switched / splitter toggled: index of the block the switch now points at
+        - circuit completed: total circuits completed by the train
+        - ride stopped (train and block -1): index of the reason in downtime.STOP_KINDS
+        - ride restarted (train and block -1): 0.  every train is back in the block it started the run in
+Rows are buffered in preallocated arrays and written every chunk_size events to <path>/chunk_NNNNNN.npz, one array
+per column, so memory stays bounded however long the run is.  close() writes the last partial chunk.
+A directory that already has files in it is refused (ValueError) so two runs can't write over each other's logs, unless
+overwrite=True, which deletes the old chunks and meta.json first.
+<path>/meta.json holds the block, train and event names and the block each train started in, which together with the
+events is enough to replay the run.
+
+Reading:
+    for time, kind, train, block, value in iter_events('run_log'):
+        ...
+iter_chunks() yields the columns of one chunk at a time for vectorized analysis.
+"""
+
+import glob
+import json
+import os
+
+import numpy as np
+
+EVENT_BLOCK_ENTERED = 0
+EVENT_HELD = 1
+EVENT_RELEASED = 2
+EVENT_MERGER_SWITCHED = 3
+EVENT_SPLITTER_TOGGLED = 4
+EVENT_CIRCUIT_COMPLETED = 5
+EVENT_RIDE_STOPPED = 6
+EVENT_RIDE_RESTARTED = 7
+EVENT_NAMES = [
+    'block entered', 'held', 'released', 'merger switched', 'splitter toggled', 'circuit completed', 'ride stopped',
+    'ride restarted'
+]
+
+COLUMNS = {
+    'time': np.int64,
+    'kind': np.int8,
+    'train': np.int16,
+    'block': np.int16,
+    'value': np.int64
+}
+
+
+class EventLog:
+    def __init__(self, path, block_names, train_names, initial_train_blocks, chunk_size=65536, overwrite=False):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.columns = {name: np.zeros(chunk_size, dtype=dtype) for name, dtype in COLUMNS.items()}
+        self.count = 0
+        self.chunks_written = 0
+        os.makedirs(path, exist_ok=True)
+        if os.listdir(path):
+            if not overwrite:
+                raise ValueError(f"Event log directory {path} is not empty.  Pass overwrite=True (event_log_overwrite "
+                                 f"in optional_params) to replace the log in it.")
+            for old_file in glob.glob(os.path.join(path, 'chunk_*.npz')) + [os.path.join(path, 'meta.json')]:
+                if os.path.exists(old_file):
+                    os.remove(old_file)
+        meta = {
+            'columns': list(COLUMNS),
+            'event_names': EVENT_NAMES,
+            'block_names': list(block_names),
+            'train_names': list(train_names),
+            'initial_train_blocks': list(initial_train_blocks)
+        }
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump(meta, f, indent=2)
+
+    def record(self, time, kind, train, block, value=0):
+        i = self.count
+        self.columns['time'][i] = time
+        self.columns['kind'][i] = kind
+        self.columns['train'][i] = train
+        self.columns['block'][i] = block
+        self.columns['value'][i] = value
+        self.count = i + 1
+        if self.count == self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """ write buffered events to the next chunk file """
+        if not self.count:
+            return
+        chunk_path = os.path.join(self.path, f'chunk_{self.chunks_written:06d}.npz')
+        np.savez(chunk_path, **{name: column[:self.count] for name, column in self.columns.items()})
+        self.chunks_written += 1
+        self.count = 0
+
+    def close(self):
+        self.flush()
+
+
+def iter_chunks(path):
+    """ yield a dict of column name -> array for each chunk in path, in time order """
+    for chunk_path in sorted(glob.glob(os.path.join(path, 'chunk_*.npz'))):
+        with np.load(chunk_path) as chunk:
+            yield {name: chunk[name] for name in COLUMNS}
+
+
+def load_meta(path):
+    with open(os.path.join(path, 'meta.json')) as f:
+        return json.load(f)
+
+
+def iter_events(path):
+    """ yield (time, kind name, train name, block name, value) for every event in path """
+    meta = load_meta(path)
+    for chunk in iter_chunks(path):
+        for time, kind, train, block, value in zip(*[chunk[name].tolist() for name in COLUMNS]):
+            train_name = meta['train_names'][train] if train >= 0 else None
+            block_name = meta['block_names'][block] if block >= 0 else None
+            yield time, meta['event_names'][kind], train_name, block_name, value
@@ -0,0 +1,444 @@
+"""
+Kernel module - Alex Borger
+
+Compiled backend for the per-second block state machine.
+
+The circuit is packed into flat integer arrays (see the column constants below):
+    - trains: one row per train
+    - held_by_block: seconds each train was held at each block (Train.history['total_seconds_held'])
+    - block_state: one row per block for the parts of a block that change while simulating
+    - block_params: one row per block for the fixed parts of block_dict, built from layout.Layout
+run_kernel() then applies Circuit.step() to those arrays for a number of seconds.  When Numba is installed it is
+compiled with njit, otherwise the same function runs as plain Python, which is only useful for checking the kernel.
+Numba is only imported the first time a kernel runs (compile_kernels), so importing this module for pack_state /
+unpack_state, as Circuit does for every backend, stays cheap.
+
+run_replicas() runs many independent replicas of one layout for batch.BatchCircuit: the same arrays with a leading
+replica axis, plus one row of replica_state (the R_* columns) each for its time, delay buffer position and downtime.
+Each replica runs run_kernel(), stopping and restarting the ride the same way as Circuit.run() (see downtime.py), and
+replicas are spread over threads with prange.
+
+Dispatch delays come from the circuit's delay buffer (Circuit.next_delay), which is drawn from circuit.rng in bulk, so
+both backends see the same delays.  The kernel stops before a second where the buffer could run out and
+run_compiled() tops it up.
+
+crosscheck() runs the Python backend and the kernel side by side one second at a time and raises AssertionError at
+the first second where the two disagree.
+"""
+
+import importlib.util
+
+import numpy as np
+
+from downtime import STOP_GRIDLOCK, STOP_101, STOP_BREAKDOWN, RideFault
+from layout import Layout, STATUS_HELD, STATUS_BEFORE_BLOCK, STATUS_AFTER_BLOCK_FROM_HELD, STATUS_AFTER_BLOCK_NOT_HELD
+
+HAVE_NUMBA = importlib.util.find_spec('numba') is not None
+# numba.prange once compiled
+prange = range
+
+# trains columns
+T_BLOCK = 0
+T_NEXT_BLOCK = 1
+T_STATUS = 2
+T_REACH = 3
+T_CLEAR_FROM_HELD = 4
+T_CLEAR_IN_MOTION = 5
+T_CLEAR_MERGER = 6
+T_MERGER_TO_BLOCK = 7
+T_HELD_AT_BLOCK = 8
+T_TOTAL_HELD = 9
+T_HOLD_LEFT = 10
+T_CIRCUITS = 11
+NUM_TRAIN_FIELDS = 12
+
+# block_state columns
+S_OCCUPIED = 0
+S_MERGER_POSITION = 1
+S_NEXT = 2
+NUM_STATE_FIELDS = 3
+
+# block_params columns
+P_REACH = 0
+P_CLEAR_FROM_HELD = 1
+P_CLEAR_IN_MOTION = 2
+P_CAN_OPERATE = 3
+P_MANDATORY_HOLD = 4
+P_HOLD_TIME = 5
+P_HAS_MERGER = 6
+P_MERGER_A = 7
+P_MERGER_B = 8
+P_CLEAR_MERGER = 9
+P_CORR_SPLITTER = 10
+P_HAS_SPLITTER = 11
+P_SPLITTER_A = 12
+P_SPLITTER_B = 13
+P_COMPLETES = 14
+
+# run_kernel return codes
+KERNEL_OK = 0
+KERNEL_GRIDLOCK = 1
+KERNEL_HALTED = 2
+KERNEL_NEED_DELAYS = 3
+KERNEL_COMPLETED = 4
+KERNEL_NEED_GAPS = 5
+
+# replica_state columns for run_replicas
+R_TIME = 0
+R_DELAY_POS = 1
+R_GAP_POS = 2
+R_DOWN_UNTIL = 3  # -1 while running
+R_NEXT_BREAKDOWN = 4  # -1 without breakdowns
+R_DOWNTIME = 5
+R_ERROR = 6  # KERNEL_GRIDLOCK / KERNEL_HALTED once a fault ended the replica's run, else KERNEL_OK
+R_ERROR_TIME = 7
+R_CODE = 8  # KERNEL_NEED_DELAYS / KERNEL_NEED_GAPS if the replica stopped short of the end, else KERNEL_OK
+R_STOPS = 9  # stops of each downtime.STOP_KINDS, 3 columns
+NUM_REPLICA_FIELDS = 12
+
+# run_replicas settings
+SET_MERGER_ENABLED = 0
+SET_SLUGGISH = 1
+SET_DOWNTIME = 2
+SET_RESTART_SECONDS = 3
+SET_BREAKDOWN_SECONDS = 4
+SET_BREAKDOWNS = 5
+NUM_SETTINGS = 6
+
+
+def run_kernel(seconds, time, merger_enabled, trains, held_by_block, block_state, block_params, delays, delay_pos,
+               sluggish, until_completion):
+    """ advance the packed circuit by up to `seconds` seconds.  with until_completion it stops with KERNEL_COMPLETED
+    at the end of the first second a train completes a circuit.
+    returns (code, time, delay_pos, train) where train is the halted train for KERNEL_HALTED
+    """
+    num_trains = trains.shape[0]
+    end = time + seconds
+    while time < end:
+        completed = False
+        if sluggish and delay_pos + num_trains > delays.shape[0]:
+            return KERNEL_NEED_DELAYS, time, delay_pos, -1
+        trains_blocked = 0
+        for i in range(num_trains):
+            curr = trains[i, T_BLOCK]
+            nxt = block_state[curr, S_NEXT]
+            if trains[i, T_STATUS] == STATUS_HELD:
+                if trains[i, T_HOLD_LEFT] > 0:
+                    trains[i, T_HOLD_LEFT] -= 1
+                elif occupy(block_state, block_params, nxt, curr):
+                    trains[i, T_CLEAR_FROM_HELD] = block_params[curr, P_CLEAR_FROM_HELD] - 1
+                    trains[i, T_STATUS] = STATUS_AFTER_BLOCK_FROM_HELD
+                else:
+                    if not block_params[curr, P_CAN_OPERATE]:
+                        return KERNEL_HALTED, time, delay_pos, i
+                    trains[i, T_HELD_AT_BLOCK] += 1
+                    trains[i, T_TOTAL_HELD] += 1
+                    held_by_block[i, curr] += 1
+                    trains_blocked += 1
+            elif trains[i, T_REACH] > 0:
+                if block_params[curr, P_HAS_MERGER]:
+                    if trains[i, T_CLEAR_MERGER] > 0:
+                        trains[i, T_CLEAR_MERGER] -= 1
+                        if trains[i, T_CLEAR_MERGER] == 0 and merger_enabled:
+                            clear_merger(block_state, block_params, curr)
+                    else:
+                        trains[i, T_MERGER_TO_BLOCK] -= 1
+                trains[i, T_REACH] -= 1
+            elif trains[i, T_CLEAR_FROM_HELD] > 0:
+                trains[i, T_CLEAR_FROM_HELD] -= 1
+            elif trains[i, T_CLEAR_IN_MOTION] > 0:
+                trains[i, T_CLEAR_IN_MOTION] -= 1
+            elif trains[i, T_STATUS] == STATUS_BEFORE_BLOCK:
+                if block_params[curr, P_MANDATORY_HOLD]:
+                    trains[i, T_STATUS] = STATUS_HELD
+                    trains[i, T_HOLD_LEFT] = block_params[curr, P_HOLD_TIME] - 1
+                    if sluggish:
+                        trains[i, T_HOLD_LEFT] += delays[delay_pos]
+                        delay_pos += 1
+                elif occupy(block_state, block_params, nxt, curr):
+                    trains[i, T_CLEAR_IN_MOTION] = block_params[curr, P_CLEAR_IN_MOTION] - 1
+                    trains[i, T_STATUS] = STATUS_AFTER_BLOCK_NOT_HELD
+                else:
+                    trains[i, T_STATUS] = STATUS_HELD
+                    trains_blocked += 1
+                    if not block_params[curr, P_CAN_OPERATE]:
+                        return KERNEL_HALTED, time, delay_pos, i
+                    trains[i, T_HELD_AT_BLOCK] += 1
+            else:
+                # leave the current block for the next one
+                trains[i, T_BLOCK] = nxt
+                trains[i, T_NEXT_BLOCK] = block_state[nxt, S_NEXT]
+                trains[i, T_REACH] = block_params[nxt, P_REACH] - 1
+                trains[i, T_CLEAR_MERGER] = block_params[nxt, P_CLEAR_MERGER]
+                if trains[i, T_CLEAR_MERGER] > 0:
+                    trains[i, T_CLEAR_MERGER] -= 1
+                trains[i, T_HELD_AT_BLOCK] = 0
+                trains[i, T_STATUS] = STATUS_BEFORE_BLOCK
+                block_state[curr, S_OCCUPIED] = 0
+                if block_params[curr, P_HAS_SPLITTER] and num_trains > 1:
+                    if nxt == block_params[curr, P_SPLITTER_A]:
+                        block_state[curr, S_NEXT] = block_params[curr, P_SPLITTER_B]
+                    else:
+                        block_state[curr, S_NEXT] = block_params[curr, P_SPLITTER_A]
+                if block_params[nxt, P_COMPLETES]:
+                    trains[i, T_CIRCUITS] += 1
+                    completed = True
+        if trains_blocked == num_trains:
+            return KERNEL_GRIDLOCK, time, delay_pos, -1
+        time += 1
+        if completed and until_completion:
+            return KERNEL_COMPLETED, time, delay_pos, -1
+    return KERNEL_OK, time, delay_pos, -1
+
+
+def occupy(block_state, block_params, target, requester):
+    """ Block.occupy on packed arrays """
+    if block_state[target, S_OCCUPIED]:
+        return False
+    if block_params[target, P_HAS_MERGER] and block_state[target, S_MERGER_POSITION] != requester:
+        return False
+    block_state[target, S_OCCUPIED] = 1
+    return True
+
+
+def clear_merger(block_state, block_params, merger):
+    """ Circuit.clear_merger on packed arrays """
+    active = block_state[merger, S_MERGER_POSITION]
+    if active == block_params[merger, P_MERGER_A]:
+        inactive = block_params[merger, P_MERGER_B]
+    else:
+        inactive = block_params[merger, P_MERGER_A]
+    active_occupied = block_state[active, S_OCCUPIED]
+    inactive_occupied = block_state[inactive, S_OCCUPIED]
+    switch = False
+    if not active_occupied and not inactive_occupied:
+        switch = block_state[block_params[merger, P_CORR_SPLITTER], S_NEXT] == inactive
+    elif not active_occupied and inactive_occupied:
+        switch = True
+    if switch:
+        block_state[merger, S_MERGER_POSITION] = inactive
+
+
+def stop_replica(replica, kind, seconds):
+    """ Circuit.stop for one row of replica_state """
+    replica[R_STOPS + kind] += 1
+    replica[R_DOWN_UNTIL] = replica[R_TIME] + seconds
+    replica[R_NEXT_BREAKDOWN] = -1
+
+
+def restart_replica(trains, block_state, initial_trains, initial_block_state):
+    """ Circuit.restart on packed arrays: back to the initial state, keeping seconds held and circuits completed """
+    for i in range(trains.shape[0]):
+        for field in range(NUM_TRAIN_FIELDS):
+            if field != T_TOTAL_HELD and field != T_CIRCUITS:
+                trains[i, field] = initial_trains[i, field]
+    block_state[:, :] = initial_block_state
+
+
+def run_replica(end, trains, held_by_block, block_state, block_params, initial_trains, initial_block_state, delays,
+                gaps, replica, settings):
+    """ Circuit.run() up to time end for one replica.  a replica whose downtime ends at end restarts on the next
+    call, like BatchCircuit.step()
+    """
+    replica[R_CODE] = KERNEL_OK
+    while replica[R_TIME] < end and replica[R_ERROR] == KERNEL_OK:
+        time = replica[R_TIME]
+        if replica[R_DOWN_UNTIL] > time:
+            down = min(replica[R_DOWN_UNTIL], end) - time
+            replica[R_TIME] += down
+            replica[R_DOWNTIME] += down
+            continue
+        if replica[R_DOWN_UNTIL] == time:
+            if settings[SET_BREAKDOWNS]:
+                if replica[R_GAP_POS] >= gaps.shape[0]:
+                    replica[R_CODE] = KERNEL_NEED_GAPS
+                    return
+                replica[R_NEXT_BREAKDOWN] = time + gaps[replica[R_GAP_POS]]
+                replica[R_GAP_POS] += 1
+            restart_replica(trains, block_state, initial_trains, initial_block_state)
+            replica[R_DOWN_UNTIL] = -1
+        until = end
+        if 0 <= replica[R_NEXT_BREAKDOWN] < end:
+            until = replica[R_NEXT_BREAKDOWN]
+        if until > time:
+            code, time, delay_pos, _ = run_kernel(
+                until - time, time, settings[SET_MERGER_ENABLED], trains, held_by_block, block_state, block_params,
+                delays, replica[R_DELAY_POS], settings[SET_SLUGGISH], False
+            )
+            replica[R_TIME] = time
+            replica[R_DELAY_POS] = delay_pos
+            if code == KERNEL_NEED_DELAYS:
+                replica[R_CODE] = code
+                return
+            if code != KERNEL_OK:
+                if not settings[SET_DOWNTIME]:
+                    replica[R_ERROR] = code
+                    replica[R_ERROR_TIME] = time
+                    return
+                stop_replica(replica, STOP_GRIDLOCK if code == KERNEL_GRIDLOCK else STOP_101,
+                             settings[SET_RESTART_SECONDS])
+                continue
+        if replica[R_TIME] == replica[R_NEXT_BREAKDOWN]:
+            stop_replica(replica, STOP_BREAKDOWN, settings[SET_BREAKDOWN_SECONDS])
+
+
+def run_replicas(end, trains, held_by_block, block_state, block_params, initial_trains, initial_block_state, delays,
+                 gaps, replica_state, settings):
+    """ run_replica for every replica, in parallel once compiled.  replicas that need more delays or breakdown gaps
+    stop short of end with R_CODE set, for the caller to top up and call again
+    """
+    for r in prange(trains.shape[0]):
+        run_replica(end, trains[r], held_by_block[r], block_state[r], block_params, initial_trains,
+                    initial_block_state, delays[r], gaps[r], replica_state[r], settings)
+
+
+kernels_compiled = False
+
+
+def compile_kernels():
+    """ swap the kernels for njit compiled versions the first time one is needed, if Numba is installed """
+    global kernels_compiled, prange, occupy, clear_merger, run_kernel, stop_replica, restart_replica, run_replica, \
+        run_replicas
+    if kernels_compiled or not HAVE_NUMBA:
+        return
+    import numba
+    prange = numba.prange
+    # callees first, so each function is compiled against the compiled versions of the ones it calls
+    occupy = numba.njit(cache=True)(occupy)
+    clear_merger = numba.njit(cache=True)(clear_merger)
+    run_kernel = numba.njit(cache=True)(run_kernel)
+    stop_replica = numba.njit(cache=True)(stop_replica)
+    restart_replica = numba.njit(cache=True)(restart_replica)
+    run_replica = numba.njit(cache=True)(run_replica)
+    run_replicas = numba.njit(cache=True, parallel=True)(run_replicas)
+    kernels_compiled = True
+
+
+def layout_block_params(layout, completes_circuit):
+    """ block_params from a layout.Layout and a per block mask of circuit completion blocks """
+    return np.stack([
+        layout.seconds_to_reach_block, layout.seconds_to_clear_from_held, layout.seconds_to_clear_block_in_motion,
+        layout.can_operate_from_stop, layout.mandatory_hold, layout.hold_time, layout.has_merger_switch,
+        layout.merger_block_a, layout.merger_block_b, layout.seconds_to_clear_merger,
+        layout.corresponding_splitter_block, layout.has_splitter_switch, layout.splitter_block_a,
+        layout.splitter_block_b, np.asarray(completes_circuit)
+    ], axis=1).astype(np.int64)
+
+
+def pack_block_params(circuit, block_ref_dict):
+    return layout_block_params(Layout(block_ref_dict), circuit.completes_circuit)
+
+
+def pack_state(circuit):
+    """ (trains, held_by_block, block_state) arrays for the circuit's current state """
+    trains = np.zeros((circuit.num_trains, NUM_TRAIN_FIELDS), dtype=np.int64)
+    held_by_block = np.zeros((circuit.num_trains, len(circuit.block_list)), dtype=np.int64)
+    for i, train in enumerate(circuit.train_list):
+        trains[i] = [
+            train.block_index, circuit.blocks[train.next_block_name].index, train.status, train.seconds_to_reach_block,
+            train.seconds_to_clear_from_held, train.seconds_to_clear_block_in_motion or 0,
+            train.seconds_to_clear_merger, train.seconds_merger_to_block, train.seconds_held_at_current_block,
+            train.total_seconds_held, train.mandatory_hold_left, train.circuits_completed
+        ]
+        held = train.history['total_seconds_held']
+        held_by_block[i] = [held[block.name] for block in circuit.block_list]
+    block_state = np.zeros((len(circuit.block_list), NUM_STATE_FIELDS), dtype=np.int64)
+    for b, block in enumerate(circuit.block_list):
+        block_state[b] = [block.is_occupied, block.merger_switch_index, block.next_block_index]
+    return trains, held_by_block, block_state
+
+
+def unpack_state(circuit, trains, held_by_block, block_state):
+    """ write packed arrays back onto the circuit's Train and Block objects """
+    names = [block.name for block in circuit.block_list]
+    for i, train in enumerate(circuit.train_list):
+        row = [int(x) for x in trains[i]]
+        train.block_index = row[T_BLOCK]
+        train.current_block = names[row[T_BLOCK]]
+        train.next_block_name = names[row[T_NEXT_BLOCK]]
+        train.status = row[T_STATUS]
+        train.seconds_to_reach_block = row[T_REACH]
+        train.seconds_to_clear_from_held = row[T_CLEAR_FROM_HELD]
+        train.seconds_to_clear_block_in_motion = row[T_CLEAR_IN_MOTION]
+        train.seconds_to_clear_merger = row[T_CLEAR_MERGER]
+        train.seconds_merger_to_block = row[T_MERGER_TO_BLOCK]
+        train.seconds_held_at_current_block = row[T_HELD_AT_BLOCK]
+        train.total_seconds_held = row[T_TOTAL_HELD]
+        train.mandatory_hold_left = row[T_HOLD_LEFT]
+        train.circuits_completed = row[T_CIRCUITS]
+        train.history['total_seconds_held'] = {name: int(held) for name, held in zip(names, held_by_block[i])}
+    for b, block in enumerate(circuit.block_list):
+        block.is_occupied = bool(block_state[b, S_OCCUPIED])
+        if block.has_merger_switch:
+            block.merger_switch_index = int(block_state[b, S_MERGER_POSITION])
+            block.merger_switch_position = names[block.merger_switch_index]
+        if block.has_splitter_switch:
+            block.next_block_index = int(block_state[b, S_NEXT])
+            block.next_block_name = names[block.next_block_index]
+            block.splitter_switch_position = block.next_block_name
+
+
+def run_packed(circuit, seconds, trains, held_by_block, block_state, until_completion=False):
+    """ run the kernel on packed arrays, topping up the circuit's delay buffer as needed.
+    returns (code, train) and leaves circuit.time and the delay buffer where the kernel stopped
+    """
+    end = circuit.time + seconds
+    compile_kernels()
+    while True:
+        code, time, delay_pos, train = run_kernel(
+            end - circuit.time, circuit.time, circuit.num_trains > 1, trains, held_by_block, block_state,
+            circuit.block_params, circuit.delays, circuit.delay_pos, circuit.dispatch_sluggishness, until_completion
+        )
+        circuit.time = time
+        circuit.delay_pos = delay_pos
+        if code != KERNEL_NEED_DELAYS:
+            return code, train
+        circuit.refill_delays()
+
+
+def raise_for_code(circuit, code, train):
+    if code == KERNEL_HALTED:
+        train = circuit.train_list[train]
+        raise RideFault(STOP_101, f"Train {train.name} halted at block {train.current_block}. "
+                        f"Ride is now in 101 status.")
+    if code == KERNEL_GRIDLOCK:
+        raise RideFault(STOP_GRIDLOCK, f"Gridlock hit at t={circuit.time}!")
+
+
+def run_compiled(circuit, seconds, until_completion=False):
+    """ Circuit.advance() for the numba backend.  returns True if it stopped early because a train completed a
+    circuit (only with until_completion)
+    """
+    trains, held_by_block, block_state = pack_state(circuit)
+    code, train = run_packed(circuit, seconds, trains, held_by_block, block_state, until_completion)
+    unpack_state(circuit, trains, held_by_block, block_state)
+    raise_for_code(circuit, code, train)
+    return code == KERNEL_COMPLETED
+
+
+def crosscheck(circuit, seconds):
+    """ Circuit.run() for the crosscheck backend: step the Python backend and the kernel side by side """
+    for _ in range(seconds):
+        if circuit.dispatch_sluggishness and circuit.delay_pos + circuit.num_trains > len(circuit.delays):
+            # make sure neither side draws from circuit.rng this second
+            circuit.refill_delays()
+        time, delays, delay_pos = circuit.time, circuit.delays, circuit.delay_pos
+        trains, held_by_block, block_state = pack_state(circuit)
+        code, train = run_packed(circuit, 1, trains, held_by_block, block_state)
+        kernel_result = (code, circuit.time, circuit.delay_pos, trains, held_by_block, block_state)
+        circuit.time, circuit.delays, circuit.delay_pos = time, delays, delay_pos
+        try:
+            circuit.tick()
+            python_code = KERNEL_OK
+        except RideFault as e:
+            python_code = KERNEL_GRIDLOCK if e.kind == STOP_GRIDLOCK else KERNEL_HALTED
+            error = e
+        python_result = (python_code, circuit.time, circuit.delay_pos) + pack_state(circuit)
+        for name, kernel_value, python_value in zip(
+                ['return code', 'time', 'delay_pos', 'trains', 'held_by_block', 'block_state'],
+                kernel_result, python_result):
+            if not np.array_equal(kernel_value, python_value):
+                raise AssertionError(f"Kernel and Python backends disagree on {name} at t={time}:\n"
+                                     f"kernel: {kernel_value}\npython: {python_value}")
+        if python_code != KERNEL_OK:
+            raise error
@@ -0,0 +1,82 @@
+"""
+Layout module - Alex Borger
+
+Integer encoding of a block_ref_dict for the array-based simulators.
+
+Block names are resolved to indices once, so per-block attributes become NumPy arrays indexed by block number and
+train statuses become small integer codes.  A missing block reference is stored as -1 and a None duration as 0.
+"""
+
+import hashlib
+import json
+
+import numpy as np
+
+STATUS_HELD = 0
+STATUS_BEFORE_BLOCK = 1
+STATUS_AFTER_BLOCK_FROM_HELD = 2
+STATUS_AFTER_BLOCK_NOT_HELD = 3
+STATUS_NAMES = ['held', 'before block', 'after block - from held', 'after block - not held']
+STATUS_CODES = {name: code for code, name in enumerate(STATUS_NAMES)}
+
+
+def canonical_hash(config):
+    """ stable short hash of any JSON-able config, independent of dict key order """
+    encoded = json.dumps(config, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha1(encoded.encode('utf-8')).hexdigest()[:16]
+
+
+def layout_hash(block_ref_dict):
+    """ canonical_hash of a block_ref_dict.  block order is kept since it decides where trains start """
+    return canonical_hash(list(block_ref_dict.items()))
+
+
+class Layout:
+    def __init__(self, block_ref_dict):
+        self.block_names = list(block_ref_dict)
+        self.index = {name: i for i, name in enumerate(self.block_names)}
+        self.num_blocks = len(self.block_names)
+        self.next_block = self.block_array(block_ref_dict, 'next_block', ref=True)
+        self.seconds_to_reach_block = self.block_array(block_ref_dict, 'seconds_to_reach_block')
+        self.seconds_to_clear_from_held = self.block_array(block_ref_dict, 'seconds_to_clear_from_held')
+        self.seconds_to_clear_block_in_motion = self.block_array(block_ref_dict, 'seconds_to_clear_block_in_motion')
+        self.is_occupied = self.block_array(block_ref_dict, 'is_occupied', dtype=bool)
+        self.can_operate_from_stop = self.block_array(block_ref_dict, 'can_operate_from_stop', dtype=bool)
+        self.mandatory_hold = self.block_array(block_ref_dict, 'mandatory_hold', dtype=bool)
+        self.hold_time = self.block_array(block_ref_dict, 'hold_time')
+        self.has_merger_switch = self.block_array(block_ref_dict, 'has_merger_switch', dtype=bool)
+        self.merger_block_a = self.block_array(block_ref_dict, 'merger_block_a', ref=True)
+        self.merger_block_b = self.block_array(block_ref_dict, 'merger_block_b', ref=True)
+        self.seconds_to_clear_merger = self.block_array(block_ref_dict, 'seconds_to_clear_merger')
+        self.corresponding_splitter_block = self.block_array(block_ref_dict, 'corresponding_splitter_block', ref=True)
+        self.has_splitter_switch = self.block_array(block_ref_dict, 'has_splitter_switch', dtype=bool)
+        self.splitter_block_a = self.block_array(block_ref_dict, 'splitter_block_a', ref=True)
+        self.splitter_block_b = self.block_array(block_ref_dict, 'splitter_block_b', ref=True)
+        # merger clearance only applies to blocks with a merger switch, same as Block
+        self.seconds_to_clear_merger[~self.has_merger_switch] = 0
+
+    def block_array(self, block_ref_dict, key, dtype=np.int64, ref=False):
+        values = []
+        for name in self.block_names:
+            value = block_ref_dict[name].get(key)
+            if ref:
+                values.append(self.index[value] if value is not None else -1)
+            else:
+                values.append(value if value is not None else 0)
+        return np.array(values, dtype=dtype)
+
+    def complete_blocks(self):
+        """ indices of blocks a train can be dispatched from, i.e. not e-stop only """
+        return [i for i in range(self.num_blocks) if self.can_operate_from_stop[i]]
+
+    def initial_train_blocks(self, num_trains):
+        """ block index of each train at t=0, evenly spaced the same way as Circuit.add_trains_to_circuit """
+        valid_blocks = self.complete_blocks()
+        return [valid_blocks[round(x * len(valid_blocks) / num_trains)] for x in range(num_trains)]
+
+    def block_mask(self, block_names):
+        mask = np.zeros(self.num_blocks, dtype=bool)
+        if block_names:
+            for name in block_names:
+                mask[self.index[name]] = True
+        return mask
@@ -0,0 +1,199 @@
+"""
+Layout check module - Alex Borger
+
+Static checks of a block_ref_dict (and train count) that run in microseconds, before anything is simulated.
+
+check_layout(block_ref_dict, num_trains, optional_params) returns a dict with:
+    - errors: problems that make the configuration unusable.  Circuit would raise building it, or the run is certain to
+        stop.  Any error means feasible is False
+        - missing block fields, block references to blocks that don't exist, a splitter whose next_block isn't one of
+            its two branches
+        - merger / splitter pairs that don't point back at each other (corresponding_splitter_block /
+            corresponding_merger_block)
+        - a block that feeds a merger but isn't one of its merger_block_a/b: a train there can never be let in.  and
+            the other way round, a merger_block_a/b that doesn't lead into its merger
+        - more trains than blocks a train can stop in (can_operate_from_stop), so two trains would start in one block
+        - every train's next block taken at t=0, which is gridlock before the first second
+    - warnings: things that are legal but probably not intended, and trains above suggested_max_trains
+        - blocks no train ever reaches from where the trains start
+        - blocks off the loop, that a train passes at most once
+        - a plain block (no merger switch) fed by more than one block
+    - suggested_max_trains: a rule of thumb for the train count, not a bound.  A free block has to travel backwards
+        round the loop for trains to move, so one block that can hold a train is kept free, plus one for each splitter
+        (a free branch is no use while the splitter points at the other one) and one for each e-stop only block (a
+        train can't stop there, so the block after it has to be free when the train arrives).  Whether a train count
+        runs cleanly also depends on timings, so layouts can run above it and fail at or below it.
+    - feasible: no errors.  Only configurations that can't be built or are gridlocked at t=0 are errors; one that
+        fails hours into a run still passes
+
+validate_layout() is the same check, raising ValueError with every error if there are any.
+
+Sweeps (sweep.run_job) run this first and skip configurations with errors.
+"""
+
+from layout import Layout
+
+REQUIRED_FIELDS = [
+    'next_block', 'seconds_to_reach_block', 'seconds_to_clear_from_held', 'seconds_to_clear_block_in_motion',
+    'is_occupied', 'can_operate_from_stop', 'mandatory_hold', 'hold_time', 'has_merger_switch', 'has_splitter_switch'
+]
+MERGER_FIELDS = [
+    'merger_block_a', 'merger_block_b', 'seconds_to_clear_merger', 'seconds_merger_to_block',
+    'corresponding_splitter_block'
+]
+SPLITTER_FIELDS = ['splitter_block_a', 'splitter_block_b', 'corresponding_merger_block']
+REFERENCE_FIELDS = [
+    'next_block', 'merger_block_a', 'merger_block_b', 'corresponding_splitter_block', 'splitter_block_a',
+    'splitter_block_b', 'corresponding_merger_block'
+]
+
+
+def successors(block_ref_dict, name):
+    """ blocks a train can go to from block name: both branches of a splitter, otherwise next_block """
+    block = block_ref_dict[name]
+    if block['has_splitter_switch']:
+        return [block['splitter_block_a'], block['splitter_block_b']]
+    return [block['next_block']]
+
+
+def block_graph(block_ref_dict):
+    """ block name -> list of blocks a train can go to next """
+    return {name: successors(block_ref_dict, name) for name in block_ref_dict}
+
+
+def reachable(graph, starts):
+    """ every block a train starting in one of starts can get to, starts included """
+    seen = set(starts)
+    stack = list(starts)
+    while stack:
+        for name in graph[stack.pop()]:
+            if name not in seen:
+                seen.add(name)
+                stack.append(name)
+    return seen
+
+
+def structure_errors(block_ref_dict, optional_params):
+    """ missing fields and dangling references.  the rest of the checks assume there are none """
+    errors = []
+    for name, block in block_ref_dict.items():
+        fields = list(REQUIRED_FIELDS)
+        if block.get('has_merger_switch'):
+            fields += MERGER_FIELDS
+        if block.get('has_splitter_switch'):
+            fields += SPLITTER_FIELDS
+        missing = [field for field in fields if field not in block]
+        if missing:
+            errors.append(f"Block {name} is missing {missing}.")
+            continue
+        for field in REFERENCE_FIELDS:
+            if field in fields and block[field] not in block_ref_dict:
+                errors.append(f"Block {name} has {field} {block[field]}, which is not a block.")
+        if block['mandatory_hold'] and block['hold_time'] is None:
+            errors.append(f"Block {name} has a mandatory hold but no hold_time.")
+    completion_blocks = (optional_params or {}).get('circuit_completion_blocks') or []
+    for name in completion_blocks:
+        if name not in block_ref_dict:
+            errors.append(f"circuit_completion_blocks has {name}, which is not a block.")
+    return errors
+
+
+def switch_errors(block_ref_dict, graph):
+    errors = []
+    for name, block in block_ref_dict.items():
+        if block['has_splitter_switch']:
+            if block['next_block'] not in (block['splitter_block_a'], block['splitter_block_b']):
+                errors.append(f"Splitter {name} has next_block {block['next_block']}, which is not one of its "
+                              f"branches.")
+            merger = block_ref_dict[block['corresponding_merger_block']]
+            if not merger['has_merger_switch'] or merger['corresponding_splitter_block'] != name:
+                errors.append(f"Splitter {name} and merger {block['corresponding_merger_block']} don't point at each "
+                              f"other.")
+        if block['has_merger_switch']:
+            splitter = block_ref_dict[block['corresponding_splitter_block']]
+            if not splitter['has_splitter_switch'] or splitter['corresponding_merger_block'] != name:
+                errors.append(f"Merger {name} and splitter {block['corresponding_splitter_block']} don't point at each "
+                              f"other.")
+            for side in ('merger_block_a', 'merger_block_b'):
+                if name not in graph[block[side]]:
+                    errors.append(f"Merger {name} has {side} {block[side]}, which doesn't lead into it.")
+    for name, targets in graph.items():
+        for target in targets:
+            merger = block_ref_dict[target]
+            if merger['has_merger_switch'] and name not in (merger['merger_block_a'], merger['merger_block_b']):
+                errors.append(f"Block {name} leads into merger {target} but isn't one of its merger blocks.")
+    return errors
+
+
+def on_loop(graph):
+    """ blocks a train can come back to """
+    return {name for name in graph if name in reachable(graph, graph[name])}
+
+
+def suggested_max_trains(block_ref_dict, loop):
+    stoppable = sum(1 for name in loop if block_ref_dict[name]['can_operate_from_stop'])
+    e_stop_only = sum(1 for name in loop if not block_ref_dict[name]['can_operate_from_stop'])
+    splitters = sum(1 for name in loop if block_ref_dict[name]['has_splitter_switch'])
+    return max(0, stoppable - 1 - splitters - e_stop_only)
+
+
+def gridlocked_at_start(block_ref_dict, start_blocks):
+    """ True if every train's next block is occupied at t=0.  merger switch positions are ignored, so this never says
+    gridlock when a train could move
+    """
+    occupied = set(start_blocks)
+    return all(block_ref_dict[name]['next_block'] in occupied for name in start_blocks)
+
+
+def check_layout(block_ref_dict, num_trains=None, optional_params=None):
+    """ static checks of a layout, and of num_trains on it if given.  see the module docstring """
+    report = {'feasible': False, 'errors': [], 'warnings': [], 'suggested_max_trains': None}
+    errors = structure_errors(block_ref_dict, optional_params)
+    if errors:
+        report['errors'] = errors
+        return report
+    graph = block_graph(block_ref_dict)
+    errors = switch_errors(block_ref_dict, graph)
+    warnings = []
+
+    loop = on_loop(graph)
+    for name in block_ref_dict:
+        if name not in loop:
+            warnings.append(f"Block {name} is not on the loop, a train passes it at most once.")
+    inbound = {name: 0 for name in block_ref_dict}
+    for targets in graph.values():
+        for target in targets:
+            inbound[target] += 1
+    for name, count in inbound.items():
+        if count > 1 and not block_ref_dict[name]['has_merger_switch']:
+            warnings.append(f"Block {name} has no merger switch but is fed by {count} blocks.")
+    max_trains = suggested_max_trains(block_ref_dict, loop)
+
+    num_complete_blocks = sum(1 for block in block_ref_dict.values() if block['can_operate_from_stop'])
+    if num_trains is not None:
+        if num_trains < 1:
+            errors.append(f"num_trains must be at least 1, got {num_trains}.")
+        elif num_trains > num_complete_blocks:
+            errors.append(f"{num_trains} trains but only {num_complete_blocks} blocks a train can stop in, so two "
+                          f"trains would start in the same block.")
+        else:
+            layout = Layout(block_ref_dict)
+            start_blocks = [layout.block_names[i] for i in layout.initial_train_blocks(num_trains)]
+            if gridlocked_at_start(block_ref_dict, start_blocks):
+                errors.append(f"Gridlock at t=0: with {num_trains} trains every train's next block is occupied.")
+            unused = [name for name in block_ref_dict if name not in reachable(graph, start_blocks)]
+            if unused:
+                warnings.append(f"No train ever reaches {unused}.")
+            if num_trains > max_trains:
+                warnings.append(f"{num_trains} trains is more than the suggested {max_trains} for this layout, "
+                                f"gridlock or 101 status is more likely.")
+    report.update({'feasible': not errors, 'errors': errors, 'warnings': warnings, 'suggested_max_trains': max_trains})
+    return report
+
+
+def validate_layout(block_ref_dict, num_trains=None, optional_params=None):
+    """ check_layout, raising ValueError if there are errors.  returns the report otherwise """
+    report = check_layout(block_ref_dict, num_trains, optional_params)
+    if report['errors']:
+        raise ValueError(f"Invalid layout: {' '.join(report['errors'])}")
+    return report
@@ -0,0 +1,267 @@
+"""
+Metrics module - Alex Borger
+
+Streaming statistics that update on state transitions and use the same memory however long the run is.
+
+Accumulators (plain numbers in, statistics out):
+    - Welford: count, mean, variance, min, max
+    - Histogram: fixed-width bins, with an overflow bin
+    - P2Quantile: one quantile estimated with the P-squared algorithm (Jain & Chlamtac), five numbers of state
+    - WindowedCounter: events in the last `window` seconds, kept in `bucket`-second buckets
+
+Listeners (attach to a circuit with circuit.add_listener, read with .summary()):
+    - DispatchIntervals: seconds between consecutive dispatches from each station
+    - HoldDurations: seconds each train stays held at a block, from arrival (or being stopped) to release
+    - HourlyCapacity: rolling count of circuit completions over the last hour
+
+Example:
+    gaps = circuit.add_listener(DispatchIntervals(circuit))
+    circuit.run(3 * 24 * 3600)
+    print(gaps.summary()['station 1']['p95'])
+"""
+
+import math
+
+from event_log import EVENT_HELD, EVENT_RELEASED, EVENT_CIRCUIT_COMPLETED, EVENT_RIDE_RESTARTED
+
+
+class Welford:
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, x):
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+        if self.min is None or x < self.min:
+            self.min = x
+        if self.max is None or x > self.max:
+            self.max = x
+
+    @property
+    def variance(self):
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    @property
+    def std(self):
+        return math.sqrt(self.variance)
+
+
+class Histogram:
+    def __init__(self, bin_width=1, num_bins=600):
+        self.bin_width = bin_width
+        # the last bin holds everything >= bin_width * (num_bins - 1)
+        self.counts = [0] * num_bins
+        self.count = 0
+
+    def add(self, x):
+        self.counts[min(int(x // self.bin_width), len(self.counts) - 1)] += 1
+        self.count += 1
+
+    def quantile(self, p):
+        """ upper edge of the bin holding the p quantile """
+        if not self.count:
+            return None
+        target = p * self.count
+        running = 0
+        for i, count in enumerate(self.counts):
+            running += count
+            if running >= target:
+                return (i + 1) * self.bin_width
+        return len(self.counts) * self.bin_width
+
+    def nonzero_bins(self):
+        """ dict of bin lower edge -> count for the bins that have any """
+        return {i * self.bin_width: count for i, count in enumerate(self.counts) if count}
+
+
+class P2Quantile:
+    def __init__(self, p):
+        self.p = p
+        self.count = 0
+        # marker heights and positions.  until five values have been seen, heights is just the sorted values
+        self.heights = []
+        self.positions = [1, 2, 3, 4, 5]
+        self.desired = [1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5]
+        self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def add(self, x):
+        self.count += 1
+        q = self.heights
+        if self.count <= 5:
+            q.append(x)
+            q.sort()
+            return
+        n = self.positions
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= q[k + 1]:
+                k += 1
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+        # move the middle markers towards their desired positions
+        for i in range(1, 4):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                parabolic = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+                    + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+                )
+                if q[i - 1] < parabolic < q[i + 1]:
+                    q[i] = parabolic
+                else:
+                    q[i] += d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                n[i] += d
+
+    def value(self):
+        if not self.count:
+            return None
+        if self.count <= 5:
+            return self.heights[round(self.p * (self.count - 1))]
+        return self.heights[2]
+
+
+class WindowedCounter:
+    def __init__(self, window=3600, bucket=60):
+        self.window = window
+        self.bucket = bucket
+        self.buckets = [0] * (window // bucket)
+        self.current = 0
+        self.total = 0
+        # rolling window totals, sampled every time a bucket closes once the first full window has passed
+        self.rolling = Welford()
+
+    def advance(self, time):
+        """ close every bucket before the one holding time """
+        current = time // self.bucket
+        while self.current < current:
+            if (self.current + 1) * self.bucket >= self.window:
+                self.rolling.add(self.total)
+            self.current += 1
+            slot = self.current % len(self.buckets)
+            self.total -= self.buckets[slot]
+            self.buckets[slot] = 0
+
+    def add(self, time, n=1):
+        self.advance(time)
+        self.buckets[self.current % len(self.buckets)] += n
+        self.total += n
+
+
+def quantile_summary(welford, quantiles):
+    summary = {
+        'count': welford.count,
+        'mean': welford.mean,
+        'std': welford.std,
+        'min': welford.min,
+        'max': welford.max
+    }
+    for quantile in quantiles:
+        summary[f'p{round(quantile.p * 100)}'] = quantile.value()
+    return summary
+
+
+class DispatchIntervals:
+    """ seconds between consecutive dispatches (releases) from each station.
+    blocks defaults to every block with a mandatory hold
+    """
+    def __init__(self, circuit, blocks=None, quantiles=(0.5, 0.95)):
+        if blocks is None:
+            blocks = [block.name for block in circuit.block_list if block.mandatory_hold]
+        self.names = {circuit.blocks[name].index: name for name in blocks}
+        self.last_dispatch = {}
+        self.stats = {index: Welford() for index in self.names}
+        self.quantiles = {index: [P2Quantile(p) for p in quantiles] for index in self.names}
+
+    def record(self, time, kind, train, block, value):
+        if kind == EVENT_RIDE_RESTARTED:
+            # the gap over downtime isn't a dispatch interval
+            self.last_dispatch = {}
+            return
+        if kind != EVENT_RELEASED or block not in self.names:
+            return
+        if block in self.last_dispatch:
+            gap = time - self.last_dispatch[block]
+            self.stats[block].add(gap)
+            for quantile in self.quantiles[block]:
+                quantile.add(gap)
+        self.last_dispatch[block] = time
+
+    def summary(self):
+        return {name: quantile_summary(self.stats[index], self.quantiles[index]) for index, name in self.names.items()}
+
+
+class HoldDurations:
+    """ seconds from a train being held at a block (mandatory hold or stopped by an occupied block) to its release,
+    per block, with a fixed-bin histogram of each.  summary() has the histogram's non-empty bins under 'histogram'
+    and its quantiles (upper bin edges, exact to bin_width unlike the P-squared estimates) as 'histogram_p50' etc.
+    """
+    def __init__(self, circuit, quantiles=(0.5, 0.95), bin_width=1, num_bins=600):
+        self.names = [block.name for block in circuit.block_list]
+        # every train starts the run held
+        self.held_since = [circuit.time] * circuit.num_trains
+        self.stats = [Welford() for _ in self.names]
+        self.quantile_ps = quantiles
+        self.quantiles = [[P2Quantile(p) for p in quantiles] for _ in self.names]
+        self.histograms = [Histogram(bin_width, num_bins) for _ in self.names]
+
+    def record(self, time, kind, train, block, value):
+        if kind == EVENT_HELD:
+            self.held_since[train] = time
+        elif kind == EVENT_RIDE_RESTARTED:
+            # every train starts over held
+            self.held_since = [time] * len(self.held_since)
+        elif kind == EVENT_RELEASED:
+            duration = time - self.held_since[train]
+            self.stats[block].add(duration)
+            self.histograms[block].add(duration)
+            for quantile in self.quantiles[block]:
+                quantile.add(duration)
+
+    def summary(self):
+        summary = {}
+        for i, name in enumerate(self.names):
+            if not self.stats[i].count:
+                continue
+            summary[name] = quantile_summary(self.stats[i], self.quantiles[i])
+            histogram = self.histograms[i]
+            for p in self.quantile_ps:
+                summary[name][f'histogram_p{round(p * 100)}'] = histogram.quantile(p)
+            summary[name]['histogram'] = histogram.nonzero_bins()
+        return summary
+
+
+class HourlyCapacity:
+    """ circuit completions (over all trains) in the trailing window, plus statistics of that rolling count """
+    def __init__(self, circuit, window=3600, bucket=60):
+        self.circuit = circuit
+        self.counter = WindowedCounter(window, bucket)
+
+    def record(self, time, kind, train, block, value):
+        if kind == EVENT_CIRCUIT_COMPLETED:
+            self.counter.add(time)
+
+    def summary(self):
+        self.counter.advance(self.circuit.time)
+        rolling = self.counter.rolling
+        return {
+            'last_window': self.counter.total,
+            'mean': rolling.mean,
+            'std': rolling.std,
+            'min': rolling.min,
+            'max': rolling.max
+        }
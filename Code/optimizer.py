@@ -0,0 +1,182 @@
+"""
+Optimizer module - Alex Borger
+
+Searches train count, block parameters and optional_params for the highest hourly capacity.
+
+A search space maps the same keys as a sweep grid (see sweep.py) to the values allowed:
+    - a list of values, e.g. 'num_trains': [3, 4, 5, 6] or 'sluggishness_mu': [1.0, 1.5, 2.0]
+    - a (low, high) tuple for any whole number in that range, e.g. ('station 1', 'hold_time'): (25, 45)
+A configuration scores the mean cycles_per_hour over its seeds (with seconds=None each seed runs until converged).
+If any seed ends in gridlock or 101 status the configuration is infeasible and never chosen.
+
+Every simulation is one sweep job, and the rows are kept in cache_path (a sweep output file) keyed by the job's hash of
+blocks, num_trains, optional_params (seed included) and seconds.  Repeated or overlapping searches with the same cache
+only simulate configurations that have never been run.
+
+Searches:
+    - coordinate_search: starting from the middle of the space, try the other values of one key at a time and keep the
+        best.  ranges are searched with a step that halves whenever neither neighbour improves.  stops when a full pass
+        finds nothing better or after `budget` new simulations.
+    - successive_halving: every combination of the space (ranges expanded) is run on one seed, the best 1/eta are
+        kept and rerun on eta times as many seeds, and so on until one is left.  eta must be at least 2.
+
+Both return a dict with:
+    - best: the winning configuration, as an entry of explored
+    - best_overrides: its overrides, ready for sweep.apply_overrides
+    - explored: every configuration scored, in the order they were scored, with overrides, cycles_per_hour (None if
+        infeasible), seeds and errors
+    - simulations / cached: simulations run by this search and results reused from the cache
+Both raise ValueError if every configuration they scored hit gridlock or 101 status.
+
+Example:
+    result = coordinate_search(blocks, 4, optional_params, {
+        'num_trains': [3, 4, 5, 6],
+        ('station 1', 'hold_time'): (25, 45),
+        ('station 2', 'hold_time'): (25, 45)
+    }, seeds=range(4), cache_path='optimizer_cache.jsonl')
+"""
+
+import math
+
+from layout import canonical_hash
+from sweep import expand_grid, load_rows, make_job, override_label, run_jobs
+
+
+def row_capacity(row):
+    """ cycles per hour of a sweep row.  runs with seconds=None use the converged rate, which leaves out warm-up """
+    if row.get('convergence'):
+        return row['convergence']['cycles_per_hour']
+    return row['cycles_per_hour']
+
+
+class Study:
+    """ scores configurations (override dicts) through the memo cache and remembers everything it scored """
+    def __init__(self, blocks, num_trains, optional_params=None, seconds=36000, cache_path=None, max_workers=None):
+        self.blocks = blocks
+        self.num_trains = num_trains
+        self.optional_params = optional_params or {}
+        self.seconds = seconds
+        self.cache_path = cache_path
+        self.max_workers = max_workers
+        self.done = {row['job_id']: row for row in load_rows(cache_path)}
+        self.explored = {}
+        self.simulations = 0
+        self.cached = 0
+
+    def key(self, overrides):
+        return canonical_hash([[override_label(key), value] for key, value in overrides.items()])
+
+    def evaluate(self, configs, seeds):
+        """ mean cycles_per_hour of each config over seeds, None for infeasible configs """
+        seeds = list(seeds)
+        jobs = [
+            make_job(self.blocks, self.num_trains, self.optional_params, self.seconds, dict(overrides, random_seed=seed))
+            for overrides in configs for seed in seeds
+        ]
+        known = len({job['job_id'] for job in jobs if job['job_id'] in self.done})
+        before = len(self.done)
+        rows = run_jobs(jobs, self.cache_path, self.max_workers, self.done)
+        self.simulations += len(self.done) - before
+        self.cached += known
+        scores = []
+        for c, overrides in enumerate(configs):
+            config_rows = rows[c * len(seeds):(c + 1) * len(seeds)]
+            errors = sum(1 for row in config_rows if row['error'])
+            score = None if errors else sum(row_capacity(row) for row in config_rows) / len(seeds)
+            # explored is in the order configs were first scored, with the latest (most seeds) score
+            self.explored[self.key(overrides)] = {
+                'overrides': {override_label(key): value for key, value in overrides.items()},
+                'cycles_per_hour': score,
+                'seeds': len(seeds),
+                'errors': errors,
+                '_overrides': overrides
+            }
+            scores.append(score)
+        return scores
+
+    def report(self, best):
+        explored = []
+        for entry in self.explored.values():
+            explored.append({key: value for key, value in entry.items() if key != '_overrides'})
+        best_entry = self.explored[self.key(best)]
+        return {
+            'best': {key: value for key, value in best_entry.items() if key != '_overrides'},
+            'best_overrides': best_entry['_overrides'],
+            'explored': explored,
+            'simulations': self.simulations,
+            'cached': self.cached
+        }
+
+
+def better(score, best_score):
+    return score is not None and (best_score is None or score > best_score)
+
+
+def coordinate_search(blocks, num_trains, optional_params, space, seeds=(0,), seconds=36000, budget=200, start=None,
+                      cache_path=None, max_workers=None):
+    study = Study(blocks, num_trains, optional_params, seconds, cache_path, max_workers)
+    current = {}
+    steps = {}
+    for key, values in space.items():
+        if isinstance(values, tuple):
+            low, high = values
+            current[key] = (low + high) // 2
+            steps[key] = max(1, (high - low) // 4)
+        else:
+            current[key] = values[len(values) // 2]
+    current.update(start or {})
+    score = study.evaluate([current], seeds)[0]
+    improved = True
+    while improved and study.simulations < budget:
+        improved = False
+        for key, values in space.items():
+            if isinstance(values, tuple):
+                low, high = values
+                candidates = [v for v in (current[key] - steps[key], current[key] + steps[key]) if low <= v <= high]
+            else:
+                candidates = [v for v in values if v != current[key]]
+            trials = []
+            for value in candidates:
+                trial = dict(current)
+                trial[key] = value
+                trials.append(trial)
+            found = False
+            for trial, trial_score in zip(trials, study.evaluate(trials, seeds)):
+                if better(trial_score, score):
+                    current, score, found = trial, trial_score, True
+            if found:
+                improved = True
+            elif key in steps and steps[key] > 1:
+                # nothing better at this distance, look closer
+                steps[key] //= 2
+                improved = True
+            if study.simulations >= budget:
+                break
+    if score is None:
+        raise ValueError("Every configuration tried hit gridlock or 101 status.")
+    return study.report(current)
+
+
+def successive_halving(blocks, num_trains, optional_params, space, seeds=range(8), seconds=36000, eta=2,
+                       cache_path=None, max_workers=None):
+    if eta < 2:
+        raise ValueError(f"eta must be at least 2, got {eta}.")
+    study = Study(blocks, num_trains, optional_params, seconds, cache_path, max_workers)
+    seeds = list(seeds)
+    grid = {key: list(range(values[0], values[1] + 1)) if isinstance(values, tuple) else values
+            for key, values in space.items()}
+    candidates = expand_grid(grid)
+    num_seeds = 1
+    while True:
+        scores = study.evaluate(candidates, seeds[:num_seeds])
+        ranked = [config for score, _, config in sorted(
+            ((score, i, config) for i, (score, config) in enumerate(zip(scores, candidates)) if score is not None),
+            key=lambda x: (-x[0], x[1])
+        )]
+        if len(ranked) <= 1:
+            break
+        candidates = ranked[:math.ceil(len(ranked) / eta)]
+        num_seeds = min(num_seeds * eta, len(seeds))
+    if not ranked:
+        raise ValueError("Every configuration in the search space hit gridlock or 101 status.")
+    return study.report(ranked[0])
@@ -0,0 +1,139 @@
+"""
+Park module - Alex Borger
+
+Runs several rides (independent circuits, each with its own layout and train count) side by side.
+
+All rides share the park clock.  Park.run(seconds) advances every ride `chunk` seconds at a time with Circuit.run, so
+each ride uses whatever engine / backend its optional_params ask for, and all rides are at the same time between
+chunks.  A ride that hits gridlock or 101 status is stopped and its error recorded; the rest of the park keeps running.
+A ride built with on_fault='downtime' (see downtime.py) restarts after restart_seconds instead, and its downtime shows
+up in summary().
+
+Rides can be stepped one after another (default), on a thread pool (shards='thread') or on a process pool
+(shards='process').  With processes, each chunk ships the ride's snapshot() to a worker and the result back, so the
+Circuit objects here stay current but their listeners (event log, metrics) see nothing.
+
+Example:
+    park = Park()
+    park.add_ride('coaster', blocks, 4, optional_params, riders_per_train=24)
+    park.add_ride('family coaster', family_blocks, 2, family_params, riders_per_train=16)
+    park.run(36000, shards='process')
+    print(park.summary()['riders_per_hour'])
+"""
+
+import concurrent.futures
+
+from circuit import Circuit
+
+
+class Ride:
+    def __init__(self, name, circuit, riders_per_train):
+        self.name = name
+        self.circuit = circuit
+        self.riders_per_train = riders_per_train
+        self.error = None
+        self.error_time = None
+
+
+def run_ride_chunk(block_ref_dict, num_trains, optional_params, snapshot, seconds):
+    """ process pool worker: carry a ride on from snapshot for seconds.  returns (snapshot, error message or None) """
+    optional_params = dict(optional_params)
+    optional_params.pop('event_log', None)
+    circuit = Circuit(block_ref_dict=block_ref_dict, num_trains=num_trains, optional_params=optional_params)
+    circuit.restore(snapshot)
+    error = None
+    try:
+        circuit.run(seconds)
+    except ValueError as e:
+        error = str(e)
+    return circuit.snapshot(), error
+
+
+class Park:
+    def __init__(self):
+        self.rides = {}
+        self.time = 0
+
+    def add_ride(self, name, block_ref_dict, num_trains, optional_params=None, riders_per_train=24):
+        if name in self.rides:
+            raise ValueError(f"Park already has a ride named {name}.")
+        if self.time:
+            raise ValueError("Rides must be added before the park starts running.")
+        circuit = Circuit(block_ref_dict=block_ref_dict, num_trains=num_trains, optional_params=optional_params)
+        self.rides[name] = Ride(name, circuit, riders_per_train)
+        return self.rides[name]
+
+    def running(self):
+        return [ride for ride in self.rides.values() if ride.error is None]
+
+    def run(self, seconds, chunk=3600, shards=None, max_workers=None):
+        """ advance every running ride by seconds on the shared clock """
+        if shards not in [None, 'thread', 'process']:
+            raise ValueError(f"{shards} not a valid sharding.  Must be in [None, 'thread', 'process'].")
+        pool = None
+        if shards == 'thread':
+            pool = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        elif shards == 'process':
+            pool = concurrent.futures.ProcessPoolExecutor(max_workers=max_workers)
+        try:
+            end = self.time + seconds
+            while self.time < end:
+                step = min(chunk, end - self.time)
+                rides = self.running()
+                if shards == 'process':
+                    futures = [
+                        pool.submit(run_ride_chunk, ride.circuit.block_ref_dict, ride.circuit.num_trains,
+                                    ride.circuit.optional_params, ride.circuit.snapshot(), step)
+                        for ride in rides
+                    ]
+                    for ride, future in zip(rides, futures):
+                        snapshot, error = future.result()
+                        ride.circuit.restore(snapshot)
+                        if error:
+                            self.stop_ride(ride, error)
+                elif shards == 'thread':
+                    list(pool.map(lambda ride: self.run_ride(ride, step), rides))
+                else:
+                    for ride in rides:
+                        self.run_ride(ride, step)
+                self.time += step
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+    def run_ride(self, ride, seconds):
+        try:
+            ride.circuit.run(seconds)
+        except ValueError as e:
+            self.stop_ride(ride, str(e))
+
+    def stop_ride(self, ride, error):
+        ride.error = error
+        ride.error_time = ride.circuit.time
+
+    def summary(self):
+        """ per ride throughput and park totals.  a stopped ride adds nothing to the park totals after it stopped """
+        rides = {}
+        riders = 0
+        for name, ride in self.rides.items():
+            summary = ride.circuit.summary()
+            ride_riders = summary['circuits_completed'] * ride.riders_per_train
+            riders += ride_riders
+            rides[name] = {
+                'num_trains': summary['num_trains'],
+                'circuits_completed': summary['circuits_completed'],
+                # while the ride was running
+                'cycles_per_hour': summary['cycles_per_hour'],
+                # over the whole park run, so downtime counts
+                'riders_per_hour': ride_riders * 3600 / self.time if self.time else 0.0,
+                'downtime_seconds': summary['downtime']['seconds'] if 'downtime' in summary else 0,
+                'error': ride.error,
+                'error_time': ride.error_time
+            }
+        return {
+            'time': self.time,
+            'riders': riders,
+            'riders_per_hour': riders * 3600 / self.time if self.time else 0.0,
+            'rides_down': [name for name, ride in self.rides.items() if ride.error is not None],
+            'rides': rides
+        }
@@ -0,0 +1,202 @@
+"""
+Profiler module - Alex Borger
+
+Opt-in instrumentation of the block state machine, for finding out where a run spends its time.
+
+    profiler = Profiler(timers=True)
+    profiler.attach(circuit)
+    circuit.run(36000)
+    print(profiler.format_report())
+
+attach() swaps profiled versions of step_train, clear_merger, emit, log_train, run, step and tick onto that one circuit
+instance,
+and detach() takes them off again.  Circuit itself has no profiling code, so an unprofiled circuit runs exactly as
+fast as before.
+
+Collected:
+    - branch_counts: how many times each branch of the state machine (BRANCHES) ran
+    - occupy_counts: Block.occupy attempts by the state machine, 'accepted' or rejected by reason ('occupied',
+        'merger in motion', 'wrong switch position'), in total and per requested block
+    - timers (timers=True): wall seconds in run, step_train, clear_merger, listeners (emit) and verbose logging.
+        run is the time in Circuit.run, step or tick, whichever was called from outside, so step loops are timed too.
+        step_train includes the other three
+    - hooks: add_hook(callback) calls callback(time, branch, train index) after every step that takes one of
+        TRANSITION_BRANCHES, not on the countdown seconds in between.  Circuit.add_listener gets the same transitions
+        as events without a profiler attached
+
+With the event engine only trains that have an event are stepped, so countdown branches are counted once per event
+rather than once per second.  The numba and crosscheck backends can't be profiled.
+"""
+
+import json
+import time
+
+from layout import STATUS_HELD, STATUS_BEFORE_BLOCK
+
+BRANCH_HOLD_COUNTDOWN = 'held: hold countdown'
+BRANCH_HELD_BLOCKED = 'held: blocked'
+BRANCH_HELD_RELEASED = 'held: released'
+BRANCH_MERGER_COUNTDOWN = 'moving: merger countdown'
+BRANCH_MERGER_CLEARED = 'moving: merger cleared'
+BRANCH_MERGER_TO_BLOCK = 'moving: merger to block'
+BRANCH_TO_BLOCK = 'moving: to block'
+BRANCH_CLEAR_FROM_HELD = 'moving: clear from held'
+BRANCH_CLEAR_IN_MOTION = 'moving: clear in motion'
+BRANCH_ARRIVE_HOLD = 'arrival: mandatory hold'
+BRANCH_ARRIVE_BLOCKED = 'arrival: blocked'
+BRANCH_ARRIVE_PASS = 'arrival: pass through'
+BRANCH_LEAVE = 'leave block'
+BRANCHES = [
+    BRANCH_HOLD_COUNTDOWN, BRANCH_HELD_BLOCKED, BRANCH_HELD_RELEASED, BRANCH_MERGER_COUNTDOWN, BRANCH_MERGER_CLEARED,
+    BRANCH_MERGER_TO_BLOCK, BRANCH_TO_BLOCK, BRANCH_CLEAR_FROM_HELD, BRANCH_CLEAR_IN_MOTION, BRANCH_ARRIVE_HOLD,
+    BRANCH_ARRIVE_BLOCKED, BRANCH_ARRIVE_PASS, BRANCH_LEAVE
+]
+# branches that change a train's status or block, or a switch
+TRANSITION_BRANCHES = {
+    BRANCH_HELD_RELEASED, BRANCH_MERGER_CLEARED, BRANCH_ARRIVE_HOLD, BRANCH_ARRIVE_BLOCKED, BRANCH_ARRIVE_PASS,
+    BRANCH_LEAVE
+}
+OCCUPY_RESULTS = ['accepted', 'occupied', 'merger in motion', 'wrong switch position']
+TIMERS = ['run', 'step_train', 'clear_merger', 'listeners', 'verbose logging']
+PROFILED_METHODS = ['run', 'step', 'tick', 'step_train', 'clear_merger', 'emit', 'log_train']
+
+
+class Profiler:
+    def __init__(self, timers=False):
+        self.use_timers = timers
+        self.branch_counts = {branch: 0 for branch in BRANCHES}
+        self.occupy_counts = {result: 0 for result in OCCUPY_RESULTS}
+        self.occupy_by_block = {}
+        self.timers = {timer: 0.0 for timer in TIMERS}
+        # calls in progress per timer, so run -> tick only counts once
+        self.timer_depth = {timer: 0 for timer in TIMERS}
+        self.hooks = []
+        self.circuit = None
+        self.originals = {}
+
+    def attach(self, circuit):
+        if circuit.backend != 'python':
+            raise ValueError(f"The {circuit.backend} backend can't be profiled.")
+        if self.circuit is not None:
+            raise ValueError("Profiler is already attached to a circuit.")
+        self.circuit = circuit
+        self.occupy_by_block = {block.name: {result: 0 for result in OCCUPY_RESULTS} for block in circuit.block_list}
+        # bound methods of the class, the profiled versions below call these
+        self.originals = {name: getattr(circuit, name) for name in PROFILED_METHODS}
+        circuit.step_train = self.step_train
+        if self.use_timers:
+            circuit.run = self.timed('run', 'run')
+            circuit.step = self.timed('step', 'run')
+            circuit.tick = self.timed('tick', 'run')
+            circuit.clear_merger = self.timed('clear_merger', 'clear_merger')
+            circuit.emit = self.timed('emit', 'listeners')
+            circuit.log_train = self.timed('log_train', 'verbose logging')
+        return self
+
+    def detach(self):
+        for name in PROFILED_METHODS:
+            self.circuit.__dict__.pop(name, None)
+        self.circuit = None
+
+    def add_hook(self, callback):
+        """ callback(time, branch, train index) is called after every profiled step that takes one of
+        TRANSITION_BRANCHES
+        """
+        self.hooks.append(callback)
+
+    def timed(self, name, timer):
+        original = self.originals[name]
+
+        def timed_method(*args, **kwargs):
+            start = time.perf_counter()
+            self.timer_depth[timer] += 1
+            try:
+                return original(*args, **kwargs)
+            finally:
+                self.timer_depth[timer] -= 1
+                if not self.timer_depth[timer]:
+                    self.timers[timer] += time.perf_counter() - start
+        return timed_method
+
+    def step_train(self, i):
+        """ Circuit.step_train, counting the branch taken.  the branch is worked out from the state before the step,
+        plus the outcome for the branches that try to occupy the next block
+        """
+        circuit = self.circuit
+        train = circuit.train_list[i]
+        block = circuit.block_list[train.block_index]
+        target = None
+        if train.status == STATUS_HELD:
+            if train.mandatory_hold_left > 0:
+                branch = BRANCH_HOLD_COUNTDOWN
+            else:
+                target = circuit.block_list[block.next_block_index]
+                branches = (BRANCH_HELD_RELEASED, BRANCH_HELD_BLOCKED)
+        elif train.seconds_to_reach_block > 0:
+            if not block.has_merger_switch:
+                branch = BRANCH_TO_BLOCK
+            elif train.seconds_to_clear_merger == 1 and circuit.num_trains > 1:
+                branch = BRANCH_MERGER_CLEARED
+            elif train.seconds_to_clear_merger > 0:
+                branch = BRANCH_MERGER_COUNTDOWN
+            else:
+                branch = BRANCH_MERGER_TO_BLOCK
+        elif train.seconds_to_clear_from_held > 0:
+            branch = BRANCH_CLEAR_FROM_HELD
+        elif train.seconds_to_clear_block_in_motion > 0:
+            branch = BRANCH_CLEAR_IN_MOTION
+        elif train.status == STATUS_BEFORE_BLOCK:
+            if block.mandatory_hold:
+                branch = BRANCH_ARRIVE_HOLD
+            else:
+                target = circuit.block_list[block.next_block_index]
+                branches = (BRANCH_ARRIVE_PASS, BRANCH_ARRIVE_BLOCKED)
+        else:
+            branch = BRANCH_LEAVE
+        if target is not None:
+            reason = target.occupy_reject_reason(block.index)
+            result = reason or 'accepted'
+            self.occupy_counts[result] += 1
+            self.occupy_by_block[target.name][result] += 1
+            branch = branches[reason is not None]
+        if self.use_timers:
+            start = time.perf_counter()
+            blocked = self.originals['step_train'](i)
+            self.timers['step_train'] += time.perf_counter() - start
+        else:
+            blocked = self.originals['step_train'](i)
+        self.branch_counts[branch] += 1
+        if self.hooks and branch in TRANSITION_BRANCHES:
+            for hook in self.hooks:
+                hook(circuit.time, branch, i)
+        return blocked
+
+    def report(self):
+        report = {
+            'branch_counts': dict(self.branch_counts),
+            'occupy_counts': dict(self.occupy_counts),
+            'occupy_by_block': {
+                name: counts for name, counts in self.occupy_by_block.items() if any(counts.values())
+            }
+        }
+        if self.use_timers:
+            report['timers'] = dict(self.timers)
+        return report
+
+    def format_report(self):
+        lines = ['State machine branches:']
+        total = sum(self.branch_counts.values()) or 1
+        for branch, count in sorted(self.branch_counts.items(), key=lambda item: -item[1]):
+            lines.append(f'    {branch:<28}{count:>12}{100 * count / total:>8.1f}%')
+        lines.append('Block.occupy attempts:')
+        for result, count in self.occupy_counts.items():
+            lines.append(f'    {result:<28}{count:>12}')
+        if self.use_timers:
+            lines.append('Wall time (s):')
+            for timer, seconds in self.timers.items():
+                lines.append(f'    {timer:<28}{seconds:>12.4f}')
+        return '\n'.join(lines)
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
@@ -0,0 +1,110 @@
+"""
+Random streams module - Alex Borger
+
+Where dispatch delays (sluggishness) come from.
+
+optional_params keys, shared by Circuit and BatchCircuit:
+    - delay_distribution: 'lognormal' (default), 'exponential' or 'uniform'.  Draws are rounded to whole seconds and
+        never negative.
+        - lognormal uses sluggishness_mu and sluggishness_sigma (of the underlying normal, same as numpy)
+        - exponential and uniform take their parameters from delay_params: {'scale': ...} or {'low': ..., 'high': ...}
+    - delay_streams:
+        - 'shared' (default): one stream from random_seed, used in the order trains reach stations.  Changing anything
+            about the layout shifts every later delay.
+        - 'station': an independent stream per station, seeded from random_seed and the station name.  The n-th
+            dispatch from a station gets the same delay in any configuration run with the same seed, so two
+            configurations compared with the same seed use common random numbers.
+        - 'train': the same, with one stream per train.
+    - antithetic: True flips every draw to the other side of the distribution (z -> -z for lognormal, u -> 1 - u
+        otherwise).  Averaging a run with its antithetic twin cancels much of the delay noise.
+
+Each stream is drawn DELAY_CHUNK values at a time, so no random number call happens per tick.
+"""
+
+import zlib
+
+import numpy as np
+
+DELAY_CHUNK = 1024
+DISTRIBUTIONS = {
+    'lognormal': ('mu', 'sigma'),
+    'exponential': ('scale',),
+    'uniform': ('low', 'high')
+}
+STREAM_MODES = ['shared', 'station', 'train']
+
+
+def delay_settings(optional_params):
+    """ (distribution, params, stream mode, antithetic) from optional_params """
+    optional_params = optional_params or {}
+    distribution = optional_params.get('delay_distribution', 'lognormal')
+    if distribution not in DISTRIBUTIONS:
+        raise ValueError(f"{distribution} not a valid delay distribution.  Must be in {list(DISTRIBUTIONS)}.")
+    if distribution == 'lognormal':
+        params = {'mu': optional_params.get('sluggishness_mu'), 'sigma': optional_params.get('sluggishness_sigma')}
+    else:
+        params = dict(optional_params.get('delay_params') or {})
+    if optional_params.get('sluggishness'):
+        missing = [name for name in DISTRIBUTIONS[distribution] if params.get(name) is None]
+        if missing:
+            raise ValueError(f"The {distribution} delay distribution needs {missing}.")
+    mode = optional_params.get('delay_streams', 'shared')
+    if mode not in STREAM_MODES:
+        raise ValueError(f"{mode} not a valid delay stream mode.  Must be in {STREAM_MODES}.")
+    return distribution, params, mode, bool(optional_params.get('antithetic', False))
+
+
+def draw_delays(rng, distribution, params, size, antithetic=False):
+    """ size whole-second delays from rng """
+    if distribution == 'lognormal':
+        if antithetic:
+            delays = np.exp(params['mu'] - params['sigma'] * rng.standard_normal(size))
+        else:
+            delays = rng.lognormal(mean=params['mu'], sigma=params['sigma'], size=size)
+    else:
+        u = rng.random(size)
+        if antithetic:
+            u = 1 - u
+        if distribution == 'exponential':
+            delays = -params['scale'] * np.log1p(-u)
+        else:
+            delays = params['low'] + (params['high'] - params['low']) * u
+    return np.maximum(np.round(delays), 0).astype(np.int64)
+
+
+def stream_rng(random_seed, key):
+    """ generator for the stream named key.  depends only on the seed and the name, not on what other streams exist """
+    return np.random.default_rng(np.random.SeedSequence([random_seed, zlib.crc32(key.encode('utf-8'))]))
+
+
+class DelayStreams:
+    def __init__(self, random_seed, keys, distribution, params, antithetic=False):
+        self.distribution = distribution
+        self.params = params
+        self.antithetic = antithetic
+        self.rngs = [stream_rng(random_seed, key) for key in keys]
+        self.buffers = [np.zeros(0, dtype=np.int64) for _ in keys]
+        self.positions = [0 for _ in keys]
+
+    def next(self, stream):
+        """ next delay from stream (its index in keys) """
+        pos = self.positions[stream]
+        if pos >= len(self.buffers[stream]):
+            self.buffers[stream] = draw_delays(self.rngs[stream], self.distribution, self.params, DELAY_CHUNK,
+                                               self.antithetic)
+            pos = 0
+        self.positions[stream] = pos + 1
+        return int(self.buffers[stream][pos])
+
+    def get_state(self):
+        """ unused delays and generator state of every stream """
+        return [
+            (buffer[pos:], rng.bit_generator.state)
+            for buffer, pos, rng in zip(self.buffers, self.positions, self.rngs)
+        ]
+
+    def set_state(self, state):
+        for stream, (buffer, rng_state) in enumerate(state):
+            self.buffers[stream] = buffer
+            self.positions[stream] = 0
+            self.rngs[stream].bit_generator.state = rng_state
@@ -0,0 +1,411 @@
+"""
+Results store module - Alex Borger
+
+Append-only, columnar on-disk store for the results of many runs (sweep rows, replicas, anything with a Circuit.summary).
+
+Layout of a store directory:
+    - layouts/<layout hash>.json: the block_ref_dict of every layout in the store, for block names
+    - partitions/<partition>/: one batch of rows, never changed once written.  one .npy file per column plus meta.json
+        (number of rows, parameter names and kinds, the row range of each layout and the row ranges of each parameter
+        value, since rows are sorted by layout hash and then by parameter values)
+    - tmp/: partitions being written
+A writer builds its partition in tmp/ and renames it into partitions/ when done, so readers only ever see whole
+partitions and any number of writers (processes or machines sharing the directory) can add rows at once.  Partition
+names include the host name and process id, so two writers never pick the same one.
+
+Columns of each row:
+    - job_id, layout_hash, num_trains, random_seed, time, circuits_completed, cycles_per_hour, failed, error
+    - converged_cycles_per_hour: the rate from run_until_converged (sweeps with seconds=None), NaN otherwise
+    - downtime_seconds: seconds the ride was stopped (on_fault='downtime' or breakdowns, see downtime.py), else 0
+    - idle_percent / seconds_held: per train idle percent and per block total_seconds_held, stored flat with offsets
+    - parameters: every other optional_params entry and sweep override (e.g. 'sluggishness', 'station 1/hold_time').
+        a row that didn't set a block field parameter ran with the value in its layout, and reads back as that; any
+        other parameter it didn't set reads back as None.  each partition stores a parameter in the narrowest kind
+        that holds all its values (see PARAM_KINDS): numbers as float64 (so a query for 1 also finds 1.0, and None is
+        NaN), booleans as bool, strings as str, anything else as JSON text
+Columns are read with np.load(mmap_mode='r'), so a query only touches the partitions that hold the layout asked for,
+and only the rows it selects are copied out.  Parameter filters (where) are looked up in the row ranges in meta.json
+without reading the parameter column, and a query whose rows are one contiguous range reads views of the files.
+
+Example:
+    ingest_sweep('results', 'sweep.jsonl', blocks, optional_params)
+    store = ResultsStore('results')
+    curve = store.curve('num_trains', layout=blocks, where={'sluggishness': True})
+    print(curve['x'], curve['mean'])
+"""
+
+import json
+import math
+import os
+import socket
+import time
+
+import numpy as np
+
+from layout import layout_hash
+from sweep import load_rows
+from work_queue import write_atomic
+
+SCALAR_COLUMNS = {
+    'job_id': str,
+    'layout_hash': str,
+    'num_trains': np.int64,
+    'random_seed': np.int64,
+    'time': np.int64,
+    'circuits_completed': np.int64,
+    'cycles_per_hour': np.float64,
+    'converged_cycles_per_hour': np.float64,
+    'downtime_seconds': np.int64,
+    'failed': bool,
+    'error': str
+}
+RAGGED_COLUMNS = {
+    'idle_percent': np.float64,
+    'seconds_held': np.int64
+}
+# optional_params that say how a run was executed or logged, not what was simulated
+EXCLUDED_PARAMS = ['random_seed', 'num_trains', 'verbose', 'engine', 'backend', 'event_log', 'event_log_chunk_size',
+                   'event_log_overwrite']
+
+
+# how a partition stores a parameter column, narrowest first
+PARAM_KINDS = ['bool', 'number', 'str', 'json']
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def encode_value(value):
+    """ JSON text of a parameter value, the key of its row ranges.  numbers are stored as floats so 1 and 1.0 match """
+    if is_number(value):
+        value = float(value)
+    return json.dumps(value, sort_keys=True)
+
+
+def param_kind(values):
+    """ the first of PARAM_KINDS that holds every value """
+    if all(isinstance(value, bool) for value in values):
+        return 'bool'
+    if all(value is None or is_number(value) for value in values):
+        return 'number'
+    if all(isinstance(value, str) for value in values):
+        return 'str'
+    return 'json'
+
+
+def param_column(values, kind):
+    """ array of a parameter column of kind param_kind(values) """
+    if kind == 'bool':
+        return np.array(values, dtype=bool)
+    if kind == 'number':
+        return np.array([math.nan if value is None else value for value in values], dtype=np.float64)
+    if kind == 'str':
+        return np.array(values, dtype=str)
+    return np.array([encode_value(value) for value in values], dtype=str)
+
+
+def decode_column(values, kind):
+    """ list of the parameter values in an array from param_column """
+    if kind == 'json':
+        return [json.loads(value) for value in values]
+    values = values.tolist()
+    if kind == 'number':
+        return [None if math.isnan(value) else value for value in values]
+    return values
+
+
+def value_ranges(keys, ranges=None):
+    """ dict of key -> [[start, stop], ...] row ranges where keys holds that key """
+    ranges = {} if ranges is None else ranges
+    start = 0
+    for i in range(1, len(keys) + 1):
+        if i == len(keys) or keys[i] != keys[start]:
+            ranges.setdefault(keys[start], []).append([start, i])
+            start = i
+    return ranges
+
+
+def resolve_layout(layout):
+    """ layout hash of layout, which can be a hash already or a block_ref_dict """
+    return layout if isinstance(layout, str) else layout_hash(layout)
+
+
+def load_layout(store_dir, key):
+    with open(os.path.join(store_dir, 'layouts', f'{key}.json')) as f:
+        return json.load(f)
+
+
+def base_value(block_ref_dict, name):
+    """ value of parameter name for a row that didn't set it: the layout's value for 'block/field', else None """
+    block, _, field = name.rpartition('/')
+    return block_ref_dict.get(block, {}).get(field)
+
+
+class ResultsWriter:
+    """ buffers rows and writes them out as one partition every flush_rows rows (and on flush / close) """
+    def __init__(self, store_dir, flush_rows=10000):
+        self.store_dir = store_dir
+        self.flush_rows = flush_rows
+        self.writer = f'{socket.gethostname()}-{os.getpid()}'
+        self.partitions_written = 0
+        self.rows = []
+        self.layouts = {}
+        for sub_dir in ['layouts', 'partitions', 'tmp']:
+            os.makedirs(os.path.join(store_dir, sub_dir), exist_ok=True)
+
+    def add_layout(self, block_ref_dict):
+        key = layout_hash(block_ref_dict)
+        if key not in self.layouts:
+            path = os.path.join(self.store_dir, 'layouts', f'{key}.json')
+            if not os.path.exists(path):
+                write_atomic(path, block_ref_dict)
+            self.layouts[key] = block_ref_dict
+        return key
+
+    def add(self, block_ref_dict, summary, params=None, job_id='', random_seed=0, error=None, convergence=None):
+        """ one run: its layout, its Circuit.summary() and the parameters it was run with """
+        params = {key: value for key, value in (params or {}).items() if key not in EXCLUDED_PARAMS}
+        self.rows.append({
+            'job_id': job_id,
+            'layout_hash': self.add_layout(block_ref_dict),
+            'num_trains': summary['num_trains'],
+            'random_seed': random_seed,
+            'time': summary['time'],
+            'circuits_completed': summary['circuits_completed'],
+            'cycles_per_hour': summary['cycles_per_hour'],
+            'converged_cycles_per_hour': convergence['cycles_per_hour'] if convergence else math.nan,
+            'downtime_seconds': summary['downtime']['seconds'] if summary.get('downtime') else 0,
+            'failed': error is not None,
+            'error': error or '',
+            'idle_percent': list(summary['idle_percent'].values()),
+            # in layout block order, so store.block_names() labels them
+            'seconds_held': [summary['total_seconds_held'][block] for block in block_ref_dict],
+            'params': params
+        })
+        if len(self.rows) >= self.flush_rows:
+            self.flush()
+
+    def add_circuit(self, circuit, params=None, job_id='', error=None, convergence=None):
+        """ a finished Circuit, with its optional_params (plus params) as the parameters """
+        self.add(circuit.block_ref_dict, circuit.summary(), dict(circuit.optional_params, **(params or {})), job_id,
+                 circuit.random_seed, error, convergence)
+
+    def add_sweep_row(self, row, blocks, optional_params=None):
+        """ a sweep row.  blocks / optional_params are the sweep's starting point, so every row of a sweep shares one
+        layout hash and block overrides show up as parameters
+        """
+        params = dict(optional_params or {}, **row['overrides'])
+        self.add(blocks, row, params, row['job_id'], row['random_seed'], row['error'], row.get('convergence'))
+
+    def flush(self):
+        """ write the buffered rows as a new partition """
+        if not self.rows:
+            return None
+        rows = self.rows
+        self.rows = []
+        params = sorted({key for row in rows for key in row['params']})
+        param_values = [
+            [row['params'][key] if key in row['params'] else base_value(self.layouts[row['layout_hash']], key)
+             for row in rows]
+            for key in params
+        ]
+        kinds = [param_kind(values) for values in param_values]
+        columns = [param_column(values, kind) for values, kind in zip(param_values, kinds)]
+        # by layout, then by each parameter in name order, so every parameter value is a few row ranges
+        layout_column = np.array([row['layout_hash'] for row in rows], dtype=str)
+        order = np.lexsort(columns[::-1] + [layout_column])
+        rows = [rows[i] for i in order]
+        name = f'{time.time_ns():016x}-{self.writer}-{self.partitions_written}'
+        tmp_dir = os.path.join(self.store_dir, 'tmp', name)
+        os.makedirs(tmp_dir)
+        for column, dtype in SCALAR_COLUMNS.items():
+            np.save(os.path.join(tmp_dir, f'{column}.npy'), np.array([row[column] for row in rows], dtype=dtype))
+        for column, dtype in RAGGED_COLUMNS.items():
+            lengths = [len(row[column]) for row in rows]
+            np.save(os.path.join(tmp_dir, f'{column}.npy'),
+                    np.array([value for row in rows for value in row[column]], dtype=dtype))
+            np.save(os.path.join(tmp_dir, f'{column}_offsets.npy'), np.concatenate([[0], np.cumsum(lengths)]))
+        param_ranges = {}
+        for i, (key, values) in enumerate(zip(params, param_values)):
+            np.save(os.path.join(tmp_dir, f'param_{i}.npy'), columns[i][order])
+            param_ranges[key] = value_ranges([encode_value(values[j]) for j in order])
+        layouts = {key: ranges[0] for key, ranges in value_ranges([row['layout_hash'] for row in rows]).items()}
+        with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+            json.dump({'rows': len(rows), 'params': params, 'param_kinds': kinds, 'param_ranges': param_ranges,
+                       'layouts': layouts, 'writer': self.writer}, f)
+        os.rename(tmp_dir, os.path.join(self.store_dir, 'partitions', name))
+        self.partitions_written += 1
+        return name
+
+    def close(self):
+        self.flush()
+
+
+class Partition:
+    def __init__(self, path):
+        self.path = path
+        self.store_dir = os.path.dirname(os.path.dirname(path))
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        self.num_rows = meta['rows']
+        self.params = {key: f'param_{i}' for i, key in enumerate(meta['params'])}
+        self.param_kinds = dict(zip(meta['params'], meta['param_kinds']))
+        self.param_ranges = meta['param_ranges']
+        self.layouts = meta['layouts']
+
+    def column(self, name):
+        """ memory mapped column.  name is a column or a parameter this partition has """
+        name = self.params.get(name, name)
+        return np.load(os.path.join(self.path, f'{name}.npy'), mmap_mode='r')
+
+    def base_ranges(self, name):
+        """ value_ranges of a parameter this partition never saw: its base_value in each row's layout """
+        ranges = {}
+        for key, (start, stop) in self.layouts.items():
+            ranges.setdefault(encode_value(base_value(load_layout(self.store_dir, key), name)), []).append([start, stop])
+        return ranges
+
+    def param_mask(self, name, value, start, stop):
+        """ mask of rows start:stop whose parameter name equals value, from the row ranges in meta.json """
+        ranges = self.param_ranges[name] if name in self.params else self.base_ranges(name)
+        mask = np.zeros(stop - start, dtype=bool)
+        for range_start, range_stop in ranges.get(encode_value(value), []):
+            mask[max(range_start, start) - start:max(min(range_stop, stop) - start, 0)] = True
+        return mask
+
+    def param(self, name, rows):
+        """ decoded values of parameter name in rows (a slice or row numbers) """
+        if name in self.params:
+            return decode_column(self.column(name)[rows], self.param_kinds[name])
+        values = [None] * self.num_rows
+        for key, (start, stop) in self.layouts.items():
+            values[start:stop] = [base_value(load_layout(self.store_dir, key), name)] * (stop - start)
+        row_numbers = range(rows.start, rows.stop) if isinstance(rows, slice) else rows
+        return [values[i] for i in row_numbers]
+
+
+class ResultsStore:
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+
+    def partitions(self):
+        """ every committed partition, oldest first.  listed again on each call, so new partitions show up """
+        partition_dir = os.path.join(self.store_dir, 'partitions')
+        if not os.path.isdir(partition_dir):
+            return []
+        return [Partition(os.path.join(partition_dir, name)) for name in sorted(os.listdir(partition_dir))]
+
+    def layouts(self):
+        layout_dir = os.path.join(self.store_dir, 'layouts')
+        if not os.path.isdir(layout_dir):
+            return []
+        return sorted(name[:-len('.json')] for name in os.listdir(layout_dir))
+
+    def block_ref_dict(self, layout):
+        return load_layout(self.store_dir, resolve_layout(layout))
+
+    def block_names(self, layout):
+        """ labels of the seconds_held entries of rows with this layout """
+        return list(self.block_ref_dict(layout))
+
+    def parameters(self):
+        return sorted({key for partition in self.partitions() for key in partition.params})
+
+    def iter_query(self, layout=None, where=None, columns=None):
+        """ like query, one dict per partition with matching rows.  when the matching rows of a partition are one
+        contiguous range (always without where) the scalar columns are views of the memory mapped files
+        """
+        key = resolve_layout(layout) if layout is not None else None
+        columns = columns or list(SCALAR_COLUMNS)
+        for partition in self.partitions():
+            if key is None:
+                start, stop = 0, partition.num_rows
+            elif key in partition.layouts:
+                start, stop = partition.layouts[key]
+            else:
+                continue
+            rows = slice(start, stop)
+            if where:
+                mask = np.ones(stop - start, dtype=bool)
+                for name, value in where.items():
+                    if name in SCALAR_COLUMNS:
+                        mask &= partition.column(name)[start:stop] == value
+                    else:
+                        mask &= partition.param_mask(name, value, start, stop)
+                selected = np.flatnonzero(mask)
+                if not len(selected):
+                    continue
+                if selected[-1] - selected[0] == len(selected) - 1:
+                    # one run of rows, which the parameter sort order makes the usual case
+                    rows = slice(start + selected[0], start + selected[-1] + 1)
+                else:
+                    rows = start + selected
+            yield {name: self.read_column(partition, name, rows) for name in columns}
+
+    def read_column(self, partition, name, rows):
+        if name in RAGGED_COLUMNS:
+            values = partition.column(name)
+            offsets = partition.column(f'{name}_offsets')
+            row_numbers = range(rows.start, rows.stop) if isinstance(rows, slice) else rows
+            return [values[offsets[i]:offsets[i + 1]] for i in row_numbers]
+        if name not in SCALAR_COLUMNS:
+            return partition.param(name, rows)
+        return partition.column(name)[rows]
+
+    def query(self, layout=None, where=None, columns=None):
+        """ columns (default: every scalar column) of the rows with layout (hash or block_ref_dict) whose columns or
+        parameters equal the values in where, e.g. where={'sluggishness': True, 'num_trains': 4}.  parameter columns
+        come back as lists of decoded values, idle_percent / seconds_held as lists of per row arrays
+        """
+        columns = columns or list(SCALAR_COLUMNS)
+        parts = list(self.iter_query(layout, where, columns))
+        result = {}
+        for name in columns:
+            if len(parts) == 1:
+                result[name] = parts[0][name]
+            elif name in SCALAR_COLUMNS:
+                result[name] = np.concatenate([part[name] for part in parts] or [np.zeros(0, SCALAR_COLUMNS[name])])
+            else:
+                result[name] = [value for part in parts for value in part[name]]
+        return result
+
+    def curve(self, x, y='cycles_per_hour', layout=None, where=None, include_failed=False):
+        """ mean, standard deviation and count of y for each value of x (a column or parameter), e.g.
+        curve('num_trains', layout=blocks, where={'sluggishness': True}) for capacity vs train count.  rows that
+        never set x (None) are grouped last
+        """
+        result = self.query(layout, where, [x, y, 'failed'])
+        groups = {}
+        for x_value, y_value, failed in zip(result[x], result[y], result['failed']):
+            if include_failed or not failed:
+                groups.setdefault(x_value.item() if hasattr(x_value, 'item') else x_value, []).append(y_value)
+        x_values = sorted(groups, key=lambda value: (value is None, value))
+        return {
+            'x': x_values,
+            'mean': [float(np.mean(groups[value])) for value in x_values],
+            'std': [float(np.std(groups[value])) for value in x_values],
+            'count': [len(groups[value]) for value in x_values]
+        }
+
+    def job_ids(self):
+        return {str(job_id) for partition in self.partitions() for job_id in partition.column('job_id') if job_id}
+
+
+def ingest_sweep(store_dir, rows, blocks, optional_params=None, skip_known=True):
+    """ add sweep rows (a list, or the path of a sweep output file) to the store.  with skip_known, rows whose job_id
+    is already stored are left out.  returns the number of rows added
+    """
+    if isinstance(rows, str):
+        rows = load_rows(rows)
+    known = ResultsStore(store_dir).job_ids() if skip_known else set()
+    writer = ResultsWriter(store_dir)
+    added = 0
+    for row in rows:
+        if row['job_id'] in known:
+            continue
+        writer.add_sweep_row(row, blocks, optional_params)
+        known.add(row['job_id'])
+        added += 1
+    writer.close()
+    return added
@@ -0,0 +1,74 @@
+"""
+Steady state module - Alex Borger
+
+Long-run throughput of a deterministic layout (no sluggishness) without simulating hours of operation.
+
+Without dispatch delays the block state machine is deterministic, so after a few laps the circuit falls into a cycle:
+the same positions, statuses and switch settings come back every `period_seconds`.  solve() steps the circuit until
+the state at a circuit completion repeats (Circuit.run_until_converged), then extrapolates from that one period.
+
+Returned dict:
+    - period_seconds: length of the repeating pattern
+    - cycles_per_period: circuits completed (over all trains) in one period
+    - dispatch_interval: average seconds between circuit completions, period_seconds / cycles_per_period
+    - cycles_per_hour: 3600 / dispatch_interval
+    - warmup_seconds: time before the pattern starts repeating
+    - block_utilization: fraction of the period each block is reserved by a train
+    - bottleneck_block: block with the highest utilization, i.e. the one every other block ends up waiting on
+    - downtime_percent: with on_fault='downtime', the part of the period the ride is stopped after gridlock / 101
+        status.  block utilization only counts the seconds it is running
+
+Example:
+    result = solve(blocks, 4, {'circuit_completion_blocks': ['station 1', 'station 2']})
+    print(result['cycles_per_hour'], result['bottleneck_block'])
+"""
+
+import copy
+
+from circuit import Circuit
+
+FAULT_PARAMS = ['circuit_completion_blocks', 'on_fault', 'restart_seconds']
+
+
+def solve(block_ref_dict, num_trains, optional_params=None, max_seconds=360000):
+    """ steady state of the layout.  optional_params are the same as Circuit, only circuit_completion_blocks and the
+    fault settings (on_fault, restart_seconds) are used.
+    raises ValueError for stochastic layouts, gridlock / 101 status (unless on_fault is 'downtime'), or no repeat
+    within max_seconds
+    """
+    optional_params = optional_params or {}
+    if optional_params.get('sluggishness') or optional_params.get('breakdown_mtbf') is not None:
+        raise ValueError("Steady state solver only applies to deterministic layouts, turn off sluggishness and "
+                         "breakdowns.")
+    if not optional_params.get('circuit_completion_blocks'):
+        raise ValueError("Steady state solver needs circuit_completion_blocks to count cycles.")
+    circuit = Circuit(block_ref_dict=copy.deepcopy(block_ref_dict), num_trains=num_trains,
+                      optional_params={key: optional_params[key] for key in FAULT_PARAMS if key in optional_params})
+    result = circuit.run_until_converged(max_seconds=max_seconds)
+    if not result['converged']:
+        raise ValueError(f"No repeating pattern found within {max_seconds} seconds.")
+    period = result['period_seconds']
+    cycles = result['cycles_per_period']
+    # the circuit is back at the start of the period, run one more to see how long each block is reserved
+    occupied = [0] * len(circuit.block_list)
+    downtime_start = circuit.downtime_seconds
+    for _ in range(period):
+        circuit.step()
+        if circuit.down_until is not None:
+            continue
+        for j, block in enumerate(circuit.block_list):
+            if block.is_occupied:
+                occupied[j] += 1
+    utilization = {block.name: occupied[j] / period for j, block in enumerate(circuit.block_list)}
+    result = {
+        'period_seconds': period,
+        'cycles_per_period': cycles,
+        'dispatch_interval': period / cycles,
+        'cycles_per_hour': cycles * 3600 / period,
+        'warmup_seconds': result['warmup_seconds'],
+        'block_utilization': utilization,
+        'bottleneck_block': max(utilization, key=utilization.get)
+    }
+    if circuit.on_fault == 'downtime':
+        result['downtime_percent'] = 100 * (circuit.downtime_seconds - downtime_start) / period
+    return result
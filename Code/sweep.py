@@ -0,0 +1,207 @@
+"""
+Sweep module - Alex Borger
+
+Runs a grid of Circuit configurations across a process pool.
+
+A sweep starts from the same blocks dict, num_trains and optional_params used in sim_tests.py, plus a grid of
+overrides.  Each grid key is one of:
+    - 'num_trains'
+    - an optional_params key, e.g. 'random_seed', 'sluggishness'
+    - a (block name, block field) tuple, e.g. ('station 1', 'hold_time')
+and maps to the list of values to try.  Every combination becomes one job.
+
+Each job builds its own Circuit from its own parameters (including its seed), so results do not depend on how many
+workers run the sweep or in what order jobs finish.  Finished jobs are appended to output_path as JSON lines as soon
+as they complete.  Rerunning a sweep with the same output_path skips every job already in the file, so an interrupted
+sweep picks up where it left off.
+
+With seconds=None each job runs until its cycles per hour has converged (Circuit.run_until_converged) instead of for a
+fixed time, and the row gets a 'convergence' entry with the converged rate, its confidence half width and the warm-up.
+
+Before simulating, each job goes through layout_check.check_layout.  A job with errors (broken references, more trains
+than the layout can hold, gridlock at t=0, ...) is not simulated: its row has the errors in 'error', 'skipped': True
+and zero throughput.
+
+Jobs with on_fault='downtime' (see downtime.py) don't stop at gridlock or 101 status: the ride restarts and the row's
+'downtime' entry has the seconds lost and the cycles that would have run in them.
+
+Example:
+    rows = run_sweep(blocks, 4, optional_params, grid={
+        'num_trains': [3, 4, 5],
+        ('station 1', 'hold_time'): [30, 33, 38],
+        'random_seed': list(range(10))
+    }, output_path='sweep.jsonl')
+"""
+
+import concurrent.futures
+import copy
+import itertools
+import json
+import os
+
+from circuit import Circuit
+from layout import canonical_hash
+from layout_check import check_layout
+
+
+def expand_grid(grid):
+    """ list of override dicts, one per combination of grid values, in a fixed order """
+    keys = list(grid)
+    return [dict(zip(keys, values)) for values in itertools.product(*[grid[key] for key in keys])]
+
+
+def apply_overrides(blocks, num_trains, optional_params, overrides):
+    """ copies of (blocks, num_trains, optional_params) with overrides applied """
+    blocks = copy.deepcopy(blocks)
+    optional_params = dict(optional_params or {})
+    for key, value in overrides.items():
+        if key == 'num_trains':
+            num_trains = value
+        elif isinstance(key, tuple):
+            block, field = key
+            if block not in blocks:
+                raise ValueError(f"Sweep override {key} refers to unknown block {block}.")
+            blocks[block][field] = value
+        else:
+            optional_params[key] = value
+    return blocks, num_trains, optional_params
+
+
+def override_label(key):
+    """ JSON-friendly name for a grid key """
+    return '/'.join(key) if isinstance(key, tuple) else key
+
+
+def make_job(blocks, num_trains, optional_params, seconds, overrides=None):
+    overrides = overrides or {}
+    blocks, num_trains, optional_params = apply_overrides(blocks, num_trains, optional_params, overrides)
+    job = {
+        'blocks': blocks,
+        'num_trains': num_trains,
+        'optional_params': optional_params,
+        'seconds': seconds,
+        'overrides': {override_label(key): value for key, value in overrides.items()}
+    }
+    job['job_id'] = canonical_hash([list(blocks.items()), num_trains, optional_params, seconds])
+    return job
+
+
+def skipped_row(job, errors):
+    """ result row for a job that failed layout_check.check_layout, without simulating it """
+    row = {
+        'job_id': job['job_id'],
+        'overrides': job['overrides'],
+        'random_seed': job['optional_params'].get('random_seed', 0),
+        'error': f"Layout check: {' '.join(errors)}",
+        'skipped': True
+    }
+    if job['seconds'] is None:
+        row['convergence'] = None
+    row.update({
+        'time': 0,
+        'num_trains': job['num_trains'],
+        'circuits_completed': 0,
+        'cycles_per_hour': 0.0,
+        'idle_percent': {f'train {i}': 0.0 for i in range(max(job['num_trains'], 0))},
+        'total_seconds_held': {block: 0 for block in job['blocks']}
+    })
+    return row
+
+
+def run_job(job):
+    """ run one job to completion in this process and return its result row.  jobs that fail the static layout check
+    are not simulated
+    """
+    errors = check_layout(job['blocks'], job['num_trains'], job['optional_params'])['errors']
+    if errors:
+        return skipped_row(job, errors)
+    circuit = Circuit(block_ref_dict=copy.deepcopy(job['blocks']), num_trains=job['num_trains'],
+                      optional_params=job['optional_params'])
+    error = None
+    convergence = None
+    try:
+        if job['seconds'] is None:
+            convergence = circuit.run_until_converged()
+        else:
+            circuit.run(job['seconds'])
+    except ValueError as e:
+        # gridlock / 101 status: keep what was simulated so far
+        error = str(e)
+    row = {
+        'job_id': job['job_id'],
+        'overrides': job['overrides'],
+        'random_seed': circuit.random_seed,
+        'error': error
+    }
+    if job['seconds'] is None:
+        row['convergence'] = convergence
+    row.update(circuit.summary())
+    return row
+
+
+def load_rows(output_path):
+    """ result rows already written to output_path.  a partly written last line from an interrupted run is ignored """
+    rows = []
+    if output_path and os.path.exists(output_path):
+        with open(output_path) as f:
+            for line in f:
+                try:
+                    rows.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+    return rows
+
+
+def open_for_append(output_path):
+    """ open output_path for appending rows, starting a fresh line if an interrupted run left a partial one """
+    partial = False
+    if os.path.exists(output_path) and os.path.getsize(output_path):
+        with open(output_path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            partial = f.read(1) != b'\n'
+    out = open(output_path, 'a')
+    if partial:
+        out.write('\n')
+    return out
+
+
+def run_jobs(jobs, output_path=None, max_workers=None, done=None):
+    """ result rows for jobs, in order.  only jobs missing from done (job_id -> row, read from output_path if not
+    given) are run, over a process pool or in this process if max_workers is 1.  new rows are added to done
+    """
+    if done is None:
+        done = {row['job_id']: row for row in load_rows(output_path)}
+    pending = [job for job in jobs if job['job_id'] not in done]
+    # the same configuration can show up twice in one batch
+    pending = list({job['job_id']: job for job in pending}.values())
+    if pending:
+        out = open_for_append(output_path) if output_path else None
+
+        def record(row):
+            done[row['job_id']] = row
+            if out:
+                out.write(json.dumps(row) + '\n')
+                out.flush()
+
+        try:
+            max_workers = max_workers or os.cpu_count()
+            if max_workers == 1:
+                for job in pending:
+                    record(run_job(job))
+            else:
+                with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as pool:
+                    futures = [pool.submit(run_job, job) for job in pending]
+                    for future in concurrent.futures.as_completed(futures):
+                        record(future.result())
+        finally:
+            if out:
+                out.close()
+    return [done[job['job_id']] for job in jobs]
+
+
+def run_sweep(blocks, num_trains, optional_params, grid, seconds=36000, output_path=None, max_workers=None):
+    """ run every combination in grid over a process pool (all cores by default).
+    returns the result rows in grid order
+    """
+    jobs = [make_job(blocks, num_trains, optional_params, seconds, overrides) for overrides in expand_grid(grid)]
+    return run_jobs(jobs, output_path, max_workers)
@@ -7,13 +7,26 @@ Other things that could be added here that the circuit object shouldn't be in ch
 
 - how long it actually takes to get through the circuit, maybe a function of how full the train is
 
+The simulation works on block_index and the integer status code (see layout.py).  current_block and current_status
+are kept for reading the state by name.
 """
 
+from layout import STATUS_CODES, STATUS_NAMES
+
 
 class Train:
+    __slots__ = (
+        'name', 'index', 'current_block', 'block_index', 'next_block_name', 'seconds_to_reach_block',
+        'seconds_to_clear_from_held', 'seconds_to_clear_block_in_motion', 'seconds_to_clear_merger',
+        'seconds_merger_to_block', 'seconds_held_at_current_block', 'total_seconds_held', 'mandatory_hold_left',
+        'status', 'circuits_completed', 'lead_train', 'history'
+    )
+
     def __init__(self, train_ref_dict):
         self.name = train_ref_dict['name']
+        self.index = train_ref_dict.get('index', -1)
         self.current_block = train_ref_dict['current_block']
+        self.block_index = train_ref_dict.get('block_index', -1)
         self.next_block_name = train_ref_dict['next_block_name']
         self.seconds_to_reach_block = train_ref_dict['seconds_to_reach_block']
         self.seconds_to_clear_from_held = train_ref_dict['seconds_to_clear_from_held']
@@ -23,10 +36,18 @@ class Train:
         self.seconds_held_at_current_block = train_ref_dict['seconds_held_at_current_block']
         self.total_seconds_held = train_ref_dict['total_seconds_held']
         self.mandatory_hold_left = train_ref_dict['mandatory_hold_left']
-        self.current_status = train_ref_dict['current_status']
+        self.status = STATUS_CODES[train_ref_dict['current_status']]
         self.circuits_completed = train_ref_dict['circuits_completed']
         self.lead_train = train_ref_dict['lead_train']
         self.history = {
             'total_seconds_held':
                 {}
         }
+
+    @property
+    def current_status(self):
+        return STATUS_NAMES[self.status]
+
+    @current_status.setter
+    def current_status(self, current_status):
+        self.status = STATUS_CODES[current_status]
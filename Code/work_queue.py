@@ -0,0 +1,248 @@
+"""
+Work queue module - Alex Borger
+
+Runs sweep jobs (see sweep.py) with any number of workers, on any machines that share a directory.  No broker needed.
+
+The queue is a directory with one JSON file per job in each of:
+    - pending/: waiting to run
+    - claimed/: being run.  a worker claims a job by renaming it from pending/, which only one worker can win.  the
+        worker touches the file every lease / 3 seconds while it runs the job
+    - done/: the job's result row (same row as sweep.run_job), written to a temp file and renamed into place
+    - failed/: jobs that raised something other than gridlock / 101 status, or whose lease expired max_attempts times
+A claimed job whose file hasn't been touched for `lease` seconds belongs to a worker that died, and is moved back to
+pending/ by the next worker or coordinator that looks.  Running a job twice is harmless: both runs write the same row.
+
+Coordinator side (Python):
+    submit(queue_dir, jobs) or submit_sweep(queue_dir, blocks, num_trains, optional_params, grid, seconds)
+    status(queue_dir)
+    collect(queue_dir, output_path)
+
+Workers and status from the command line, in the Code directory:
+    python work_queue.py worker QUEUE_DIR [--lease 600] [--max-jobs N] [--wait]
+    python work_queue.py status QUEUE_DIR [--lease 600]
+    python work_queue.py collect QUEUE_DIR OUTPUT_PATH
+"""
+
+import argparse
+import json
+import os
+import socket
+import threading
+import time
+import traceback
+
+from sweep import expand_grid, load_rows, make_job, open_for_append, run_job
+
+STATES = ['pending', 'claimed', 'done', 'failed']
+
+
+def state_dir(queue_dir, state):
+    return os.path.join(queue_dir, state)
+
+
+def job_ids(queue_dir, state):
+    return sorted(name[:-len('.json')] for name in os.listdir(state_dir(queue_dir, state)) if name.endswith('.json'))
+
+
+def write_atomic(path, data):
+    """ write JSON to path so readers never see a partial file """
+    tmp_path = f'{path}.{socket.gethostname()}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def read_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def init_queue(queue_dir):
+    for state in STATES:
+        os.makedirs(state_dir(queue_dir, state), exist_ok=True)
+
+
+def submit(queue_dir, jobs):
+    """ add jobs (from sweep.make_job) to the queue, skipping any already queued, running or done.
+    returns the number added
+    """
+    init_queue(queue_dir)
+    known = set()
+    for state in STATES:
+        known.update(job_ids(queue_dir, state))
+    added = 0
+    for job in jobs:
+        if job['job_id'] in known:
+            continue
+        job = dict(job, attempts=0)
+        write_atomic(os.path.join(state_dir(queue_dir, 'pending'), f"{job['job_id']}.json"), job)
+        known.add(job['job_id'])
+        added += 1
+    return added
+
+
+def submit_sweep(queue_dir, blocks, num_trains, optional_params, grid, seconds=36000):
+    """ queue every combination in grid, same as sweep.run_sweep would run it """
+    jobs = [make_job(blocks, num_trains, optional_params, seconds, overrides) for overrides in expand_grid(grid)]
+    return submit(queue_dir, jobs)
+
+
+def claim(queue_dir):
+    """ claim the next pending job.  returns the path of the claimed file, or None if nothing is pending """
+    for job_id in job_ids(queue_dir, 'pending'):
+        pending_path = os.path.join(state_dir(queue_dir, 'pending'), f'{job_id}.json')
+        claimed_path = os.path.join(state_dir(queue_dir, 'claimed'), f'{job_id}.json')
+        try:
+            # the lease starts now, not when the job was submitted.  touched before the rename (which keeps the
+            # mtime) so the job never shows up in claimed/ with an expired lease
+            os.utime(pending_path)
+            os.rename(pending_path, claimed_path)
+        except FileNotFoundError:
+            # another worker got it first
+            continue
+        return claimed_path
+    return None
+
+
+def requeue_expired(queue_dir, lease=600, max_attempts=3):
+    """ move claimed jobs whose lease ran out back to pending (or to failed after max_attempts).  returns how many """
+    now = time.time()
+    moved = 0
+    for job_id in job_ids(queue_dir, 'claimed'):
+        claimed_path = os.path.join(state_dir(queue_dir, 'claimed'), f'{job_id}.json')
+        try:
+            if now - os.path.getmtime(claimed_path) < lease:
+                continue
+            job = read_json(claimed_path)
+        except FileNotFoundError:
+            continue
+        if os.path.exists(os.path.join(state_dir(queue_dir, 'done'), f'{job_id}.json')):
+            # finished just as the lease ran out
+            remove_quietly(claimed_path)
+            continue
+        job['attempts'] = job.get('attempts', 0) + 1
+        if job['attempts'] >= max_attempts:
+            job['failure'] = f"lease expired {job['attempts']} times"
+            write_atomic(os.path.join(state_dir(queue_dir, 'failed'), f'{job_id}.json'), job)
+        else:
+            write_atomic(os.path.join(state_dir(queue_dir, 'pending'), f'{job_id}.json'), job)
+        remove_quietly(claimed_path)
+        moved += 1
+    return moved
+
+
+def remove_quietly(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def keep_lease(claimed_path, lease, stop):
+    """ touch claimed_path every lease / 3 seconds until stop is set """
+    while not stop.wait(lease / 3):
+        try:
+            os.utime(claimed_path)
+        except FileNotFoundError:
+            return
+
+
+def work(queue_dir, lease=600, max_jobs=None, wait=False, poll_seconds=5, max_attempts=3):
+    """ claim and run jobs until the queue is empty (or, with wait, until nothing is pending or claimed).
+    returns the number of jobs this worker ran
+    """
+    init_queue(queue_dir)
+    worker = f'{socket.gethostname()}-{os.getpid()}'
+    jobs_run = 0
+    while max_jobs is None or jobs_run < max_jobs:
+        requeue_expired(queue_dir, lease, max_attempts)
+        claimed_path = claim(queue_dir)
+        if claimed_path is None:
+            if wait and (job_ids(queue_dir, 'pending') or job_ids(queue_dir, 'claimed')):
+                time.sleep(poll_seconds)
+                continue
+            break
+        try:
+            job = read_json(claimed_path)
+        except FileNotFoundError:
+            # requeued or finished by someone else between the claim and now, try the next job
+            continue
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=keep_lease, args=(claimed_path, lease, stop), daemon=True)
+        heartbeat.start()
+        try:
+            row = run_job(job)
+            row['worker'] = worker
+            write_atomic(os.path.join(state_dir(queue_dir, 'done'), f"{job['job_id']}.json"), row)
+        except Exception:
+            job['failure'] = traceback.format_exc()
+            job['worker'] = worker
+            write_atomic(os.path.join(state_dir(queue_dir, 'failed'), f"{job['job_id']}.json"), job)
+        finally:
+            stop.set()
+            heartbeat.join()
+        remove_quietly(claimed_path)
+        jobs_run += 1
+    return jobs_run
+
+
+def status(queue_dir, lease=600):
+    """ number of jobs in each state, plus claimed jobs whose lease has expired """
+    counts = {state: len(job_ids(queue_dir, state)) for state in STATES}
+    now = time.time()
+    expired = 0
+    for job_id in job_ids(queue_dir, 'claimed'):
+        try:
+            if now - os.path.getmtime(os.path.join(state_dir(queue_dir, 'claimed'), f'{job_id}.json')) >= lease:
+                expired += 1
+        except FileNotFoundError:
+            continue
+    counts['expired'] = expired
+    counts['total'] = sum(counts[state] for state in STATES)
+    return counts
+
+
+def collect(queue_dir, output_path=None):
+    """ result rows of every finished job.  with output_path, rows not already in that file are appended to it """
+    rows = [read_json(os.path.join(state_dir(queue_dir, 'done'), f'{job_id}.json'))
+            for job_id in job_ids(queue_dir, 'done')]
+    if output_path:
+        known = {row['job_id'] for row in load_rows(output_path)}
+        with open_for_append(output_path) as out:
+            for row in rows:
+                if row['job_id'] not in known:
+                    out.write(json.dumps(row) + '\n')
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Directory based work queue for sweep jobs.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    worker = commands.add_parser('worker', help='claim and run jobs')
+    worker.add_argument('queue_dir')
+    worker.add_argument('--lease', type=float, default=600, help='seconds before an untouched claimed job is retried')
+    worker.add_argument('--max-jobs', type=int, default=None)
+    worker.add_argument('--max-attempts', type=int, default=3)
+    worker.add_argument('--wait', action='store_true', help='keep polling until every job is done')
+    show = commands.add_parser('status', help='count jobs in each state')
+    show.add_argument('queue_dir')
+    show.add_argument('--lease', type=float, default=600)
+    merge = commands.add_parser('collect', help='append finished rows to a sweep output file')
+    merge.add_argument('queue_dir')
+    merge.add_argument('output_path')
+    args = parser.parse_args(argv)
+
+    if args.command == 'worker':
+        jobs_run = work(args.queue_dir, lease=args.lease, max_jobs=args.max_jobs, wait=args.wait,
+                        max_attempts=args.max_attempts)
+        print(f"Ran {jobs_run} jobs.")
+    elif args.command == 'status':
+        counts = status(args.queue_dir, lease=args.lease)
+        print(', '.join(f'{state}: {count}' for state, count in counts.items()))
+    else:
+        rows = collect(args.queue_dir, args.output_path)
+        print(f"Collected {len(rows)} rows into {args.output_path}.")
+
+
+if __name__ == '__main__':
+    main()